@@ -1,30 +1,42 @@
 import pytorch_lightning as pl
 from pytorch_lightning import Trainer
 from transformers import T5Tokenizer, T5ForConditionalGeneration, get_linear_schedule_with_warmup
-from torch.utils.data import DataLoader, Dataset, RandomSampler
+from torch.utils.data import DataLoader, Dataset, RandomSampler, Sampler
 from torch.optim import AdamW, Adam
 import pandas as pd
 import torch
 import numpy as np
 import os
+import json
+import copy
+import time
+import contextlib
 import logging
 import pickle
+from functools import partial
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 from torch.optim.optimizer import Optimizer
+from scripts.results_store import checkpoint_name, test_set_name, write_results
+from models.token_cache import build_token_cache, load_token_cache
 
 logger = logging.getLogger(__name__)
 
 
 class YesNoDataSet(Dataset):
 
-    def __init__(self, csv_path, tokenizer, max_length):
+    def __init__(self, csv_path, tokenizer, max_length, cache_dir=None, df=None):
+        """Questions and labels of csv_path, or of df (csv_path=None) when they are already in memory."""
         self.tokenizer = tokenizer
-        self.df = pd.read_csv(csv_path)
+        self.df = pd.read_csv(csv_path) if df is None else df.reset_index(drop=True)
         self.max_length = max_length
         self.yes_questions = self.df[self.df.label == 'Yes']
         self.no_questions = self.df[self.df.label == 'No']
         self.questions = self.df.question.values
         self.labels = self.df.label.values
+        # With a cache_dir samples are slices of pre-tokenized memory maps instead of being tokenized every epoch.
+        self.token_cache_path = build_token_cache(self.df, tokenizer, max_length, cache_dir, source=csv_path) \
+            if cache_dir else None
+        self.token_cache = None
 
     def __len__(self):
         return len(self.questions)
@@ -39,6 +51,12 @@ class YesNoDataSet(Dataset):
         if torch.is_tensor(idx):
             idx = idx.tolist()
 
+        if self.token_cache_path is not None:
+            # Opened lazily so DataLoader workers map the files themselves instead of receiving pickled copies.
+            if self.token_cache is None:
+                self.token_cache = load_token_cache(self.token_cache_path)
+            return {name: torch.from_numpy(array[idx]) for name, array in self.token_cache.items()}
+
         question = self.questions[idx]
         encoded_question = self.tokenizer.encode_plus(question, return_tensors="pt", max_length=self.max_length,
                                                       padding='max_length')
@@ -53,6 +71,60 @@ class YesNoDataSet(Dataset):
         sample = {'input_ids': input_ids, 'attention_mask': attention_mask, 'labels': label}
         return sample
 
+    def lengths(self):
+        """Number of question tokens of every sample, capped at max_length."""
+        if self.token_cache_path is not None:
+            return np.asarray(load_token_cache(self.token_cache_path)["attention_mask"].sum(axis=1))
+        input_ids = self.tokenizer(list(self.questions))["input_ids"]
+        return np.minimum([len(ids) for ids in input_ids], self.max_length)
+
+    @staticmethod
+    def collate(samples, pad_token_id=None):
+        # Cached samples are int32, the model expects int64 ids.
+        batch = {name: torch.stack([sample[name] for sample in samples]).long() for name in samples[0]}
+        if pad_token_id is None:
+            return batch
+        # Dynamic padding: questions are cut to the longest one in the batch and labels to their real length.
+        # Dropped columns are masked (or -100 for labels), so the loss is unchanged.
+        length = max(int(batch["attention_mask"].sum(dim=1).max()), 1)
+        label_length = max(int((batch["labels"] != pad_token_id).sum(dim=1).max()), 1)
+        batch["input_ids"] = batch["input_ids"][:, :length]
+        batch["attention_mask"] = batch["attention_mask"][:, :length]
+        batch["labels"] = batch["labels"][:, :label_length]
+        return batch
+
+
+class LengthBucketSampler(Sampler):
+    """Batches of samples with similar lengths. Samples are shuffled, split into buckets of bucket_size,
+    sorted by length within a bucket and cut into batches, and the batch order is shuffled again.
+    Every epoch draws a new shuffle from seed."""
+
+    def __init__(self, lengths, batch_size, bucket_size=None, shuffle=True, seed=0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size or batch_size * 100
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        # Every bucket ends with its own partial batch.
+        full_buckets, last_bucket = divmod(len(self.lengths), self.bucket_size)
+        return full_buckets * -(-self.bucket_size // self.batch_size) + -(-last_bucket // self.batch_size)
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        self.epoch += 1
+        indices = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = indices[start: start + self.bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind="stable")]
+            batches += [bucket[i: i + self.batch_size].tolist() for i in range(0, len(bucket), self.batch_size)]
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return iter(batches)
+
 
 class YesNoQuestionAnswering(pl.LightningModule):
     def __init__(self, model, tokenizer, config, device=None):
@@ -66,6 +138,35 @@ class YesNoQuestionAnswering(pl.LightningModule):
         output = self.model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
         return output
 
+    def yes_no_logits(self, input_ids, attention_mask):
+        """Logits of the "Yes" and "No" tokens as the first answer token, one encoder pass and one decoder step."""
+        if not hasattr(self, "yes_no_ids"):
+            self.yes_no_ids = [self.tokenizer.encode(answer, add_special_tokens=False)[0] for answer in ["Yes", "No"]]
+        decoder_input_ids = torch.full((input_ids.shape[0], 1), self.model.config.decoder_start_token_id,
+                                       dtype=torch.long, device=input_ids.device)
+        with self.autocast():
+            output = self.model(input_ids=input_ids, attention_mask=attention_mask, decoder_input_ids=decoder_input_ids)
+        return output.logits[:, 0, self.yes_no_ids].float()
+
+    def autocast(self):
+        """bfloat16 autocast for models from for_inference("bf16"), wrap every forward or generate call in it."""
+        if getattr(self, "precision", "fp32") == "bf16":
+            return torch.autocast("cpu", dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def for_inference(self, precision="fp32"):
+        """An eval copy of this model for CPU inference in precision:
+        "fp32", "int8" (dynamic int8 quantization of every Linear layer) or "bf16" (bfloat16 autocast)."""
+        model = self.model
+        if precision == "int8":
+            model = torch.quantization.quantize_dynamic(copy.deepcopy(self.model).cpu(), {torch.nn.Linear}, dtype=torch.qint8)
+        elif precision == "bf16" and not bf16_supported():
+            print("bf16 autocast is not supported by this torch build or CPU, using fp32")
+            precision = "fp32"
+        qa_model = YesNoQuestionAnswering(model=model, tokenizer=self.tokenizer, config=self.config, device=self.to_device)
+        qa_model.precision = precision
+        return qa_model.eval()
+
     def _step(self, batch):
         input_ids = batch["input_ids"]
         attention_mask = batch["attention_mask"]
@@ -110,15 +211,75 @@ class YesNoQuestionAnswering(pl.LightningModule):
         tqdm_dict = {"loss": "{:.3f}".format(self.trainer.avg_loss), "lr": self.lr_scheduler.get_last_lr()[-1]}
         return tqdm_dict
 
+    def _dataloader(self, csv_path, shuffle):
+        dataset = YesNoDataSet(csv_path=csv_path, tokenizer=self.tokenizer, max_length=self.config["max_length"],
+                               cache_dir=self.config.get("token_cache_dir"))
+        if not self.config.get("dynamic_padding"):
+            return DataLoader(dataset, batch_size=self.config.get("batch_size"), shuffle=shuffle, num_workers=4,
+                              collate_fn=YesNoDataSet.collate)
+        sampler = LengthBucketSampler(dataset.lengths(), self.config.get("batch_size"),
+                                      bucket_size=self.config.get("bucket_size"), shuffle=shuffle)
+        return DataLoader(dataset, batch_sampler=sampler, num_workers=4,
+                          collate_fn=partial(YesNoDataSet.collate, pad_token_id=self.tokenizer.pad_token_id))
+
     def train_dataloader(self):
-        dataset = YesNoDataSet(csv_path=self.config.get("train_data"), tokenizer=self.tokenizer, max_length=self.config["max_length"])
-        dataloader = DataLoader(dataset, batch_size=self.config.get("batch_size"), shuffle=True, num_workers=4)
-        return dataloader
+        return self._dataloader(self.config.get("train_data"), shuffle=True)
 
     def val_dataloader(self):
-        dataset = YesNoDataSet(csv_path=self.config.get("dev_data"), tokenizer=self.tokenizer, max_length=self.config["max_length"])
-        dataloader = DataLoader(dataset, batch_size=self.config.get("batch_size"), shuffle=False, num_workers=4)
-        return dataloader
+        return self._dataloader(self.config.get("dev_data"), shuffle=False)
+
+
+def bf16_supported():
+    """CPU bfloat16 autocast needs torch >= 1.10, and is only faster than fp32 with native bf16 instructions."""
+    if not hasattr(torch, "autocast"):
+        return False
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def batch_tokens(batch, pad_token_id):
+    """Real (non pad) and processed (padded) encoder plus decoder tokens of a batch."""
+    real = int(batch["attention_mask"].sum()) + int((batch["labels"] != pad_token_id).sum())
+    return real, batch["input_ids"].numel() + batch["labels"].numel()
+
+
+def measure_throughput(config, num_of_batches=50):
+    """Training steps per second on train_data with fixed and with dynamic padding, as real and padded tokens/s."""
+    tokenizer = T5Tokenizer.from_pretrained(config.get("model_name"), cache_dir="../cache/")
+    model = T5ForConditionalGeneration.from_pretrained(config.get("model_name"), cache_dir="../cache/")
+    device = config["device"]
+    results = dict()
+    for dynamic_padding in [False, True]:
+        qa_model = YesNoQuestionAnswering(tokenizer=tokenizer, model=model, config={**config, "dynamic_padding": dynamic_padding},
+                                          device=device).to(device)
+        real_tokens, padded_tokens = 0, 0
+        start = None
+        for idx, batch in enumerate(qa_model.train_dataloader()):
+            if idx == num_of_batches + 1:
+                break
+            # The first batch warms up workers and kernels and is not timed.
+            if idx == 1:
+                start = time.time()
+            if idx >= 1:
+                real, padded = batch_tokens(batch, tokenizer.pad_token_id)
+                real_tokens += real
+                padded_tokens += padded
+            qa_model.zero_grad()
+            qa_model.training_step(batch=batch, batch_idx=idx)["loss"].backward()
+        if device != "cpu":
+            torch.cuda.synchronize()
+        elapsed = time.time() - start
+        name = "dynamic padding" if dynamic_padding else "max_length padding"
+        results[name] = {"tokens_per_s": real_tokens / elapsed, "padded_tokens_per_s": padded_tokens / elapsed,
+                         "padding_ratio": padded_tokens / max(real_tokens, 1)}
+        print(f"{name}: {real_tokens / elapsed:.0f} tokens/s ({padded_tokens / elapsed:.0f} with padding, "
+              f"{padded_tokens / max(real_tokens, 1):.2f}x padded)")
+    model.zero_grad()
+    return results
 
 
 def train_model_without_lighting(config):
@@ -139,8 +300,11 @@ def train_model_without_lighting(config):
         print("epoch start")
         running_loss = 0
         ctr = 0
+        num_of_tokens = 0
+        start = time.time()
         # Train
         for idx, batch in enumerate(train_dataloader):
+            num_of_tokens += batch_tokens(batch, tokenizer.pad_token_id)[0]
             optim.zero_grad()
             output = model.training_step(batch=batch, batch_idx=idx)
             loss = output["loss"]
@@ -149,7 +313,8 @@ def train_model_without_lighting(config):
             running_loss += loss.item()
             ctr += 1
             if (idx % 500) == 499:
-                print(f"Training Loss={running_loss / float(ctr)} Iteration={idx}/{len(train_dataloader)} Epoch={epoch}/{config['max_epochs']}")
+                print(f"Training Loss={running_loss / float(ctr)} Iteration={idx}/{len(train_dataloader)} Epoch={epoch}/{config['max_epochs']} "
+                      f"Tokens/s={num_of_tokens / (time.time() - start):.0f}")
 
         # validation
         model.eval()
@@ -191,6 +356,153 @@ def train_model(config):
         pickle.dump(model.model_validation_loss, f)
 
 
+def yes_no_margins(config, model, data_set):
+    """Yes logit minus No logit of every question of data_set, in csv order.
+    Questions are scored in batches of sorted length, so every batch is padded to about its own length."""
+    device = config["device"]
+    batches = list(LengthBucketSampler(data_set.lengths(), config.get("batch_size"), bucket_size=max(len(data_set), 1),
+                                       shuffle=False))
+    data_loader = DataLoader(data_set, batch_sampler=batches,
+                             collate_fn=partial(YesNoDataSet.collate, pad_token_id=model.tokenizer.pad_token_id))
+    margins = np.zeros(len(data_set), dtype=np.float32)
+    with torch.no_grad():
+        for rows, batch in zip(batches, data_loader):
+            logits = model.yes_no_logits(batch["input_ids"].to(device), batch["attention_mask"].to(device))
+            margins[rows] = (logits[:, 0] - logits[:, 1]).cpu().numpy()
+    return margins
+
+
+def fit_temperature(margins, labels, temperatures=np.logspace(-2, 2, 401)):
+    """The temperature T minimizing the negative log likelihood of P(Yes) = sigmoid(margin / T) on labels."""
+    is_yes = np.asarray(labels) == "Yes"
+    signed = np.where(is_yes, 1., -1.)[None, :] * np.asarray(margins, dtype=np.float64)[None, :]
+    nll = np.logaddexp(0, -signed / temperatures[:, None]).mean(axis=1)
+    return float(temperatures[np.argmin(nll)])
+
+
+def temperature_path(config):
+    return f"{config['checkpoint']}.temperature.json" if config.get("checkpoint") else None
+
+
+def yes_no_temperature(config, model):
+    """config["temperature"], or a temperature fitted on at most config["temperature_samples"] questions of
+    config["dev_data"]. A fitted temperature is kept on the model and saved next to the checkpoint, so later
+    runs of the same checkpoint reuse it."""
+    if config.get("temperature"):
+        return config["temperature"]
+    if getattr(model, "temperature", None) is not None:
+        return model.temperature
+    fit = {"dev_data": config["dev_data"], "temperature_samples": config.get("temperature_samples", 2000),
+           "inference_precision": config.get("inference_precision", "fp32")}
+    path = temperature_path(config)
+    if path and os.path.isfile(path):
+        with open(path, "r") as f:
+            saved = json.load(f)
+        if all(saved.get(key) == value for key, value in fit.items()):
+            model.temperature = saved["temperature"]
+            print(f"Temperature from {path}: {model.temperature:.3f}")
+            return model.temperature
+
+    df = pd.read_csv(config["dev_data"])
+    if len(df) > fit["temperature_samples"]:
+        df = df.sample(n=fit["temperature_samples"], random_state=0)
+    data_set = YesNoDataSet(csv_path=None, tokenizer=model.tokenizer, max_length=config["max_length"],
+                            cache_dir=config.get("token_cache_dir"), df=df)
+    model.temperature = fit_temperature(yes_no_margins(config, model, data_set), data_set.labels.astype(str))
+    print(f"Temperature fitted on {len(df)} questions of {config['dev_data']}: {model.temperature:.3f}")
+    if path:
+        with open(path, "w") as f:
+            json.dump({**fit, "temperature": model.temperature}, f)
+    return model.temperature
+
+
+def score_yes_no(config, model, data_set, temperature=1.):
+    """Answers and P(Yes) = sigmoid((Yes logit - No logit) / temperature) of every question of data_set,
+    in csv order. The temperature calibrates P(Yes), it never changes an answer."""
+    margins = yes_no_margins(config, model, data_set)
+    p_yes = (1. / (1. + np.exp(-margins.astype(np.float64) / temperature))).astype(np.float32)
+    return np.where(margins >= 0, "Yes", "No"), p_yes
+
+
+def precision_drift_report(config, model, csv_path, precisions=("int8", "bf16"), output_path=None):
+    """Scores csv_path on CPU in fp32 and in each of precisions, and reports the speedup and how far the
+    answers drift from fp32: accuracy, answer agreement, flipped answers and P(Yes) differences."""
+    config = {**config, "device": "cpu"}
+    model = model.to("cpu").eval()
+    data_set = YesNoDataSet(csv_path=csv_path, tokenizer=model.tokenizer, max_length=config["max_length"],
+                            cache_dir=config.get("token_cache_dir"))
+    true_answers = data_set.labels.astype(str)
+    rows = []
+    for precision in ("fp32",) + tuple(precisions):
+        start = time.time()
+        answers, p_yes = score_yes_no(config, model.for_inference(precision), data_set)
+        seconds = time.time() - start
+        if precision == "fp32":
+            fp32_answers, fp32_p_yes, fp32_seconds = answers, p_yes, seconds
+        p_yes_diff = np.abs(p_yes - fp32_p_yes)
+        rows.append({"precision": precision, "seconds": seconds, "speedup": fp32_seconds / seconds,
+                     "accuracy": np.mean(answers == true_answers), "agreement": np.mean(answers == fp32_answers),
+                     "flipped": int(np.sum(answers != fp32_answers)), "mean_p_yes_diff": p_yes_diff.mean(),
+                     "max_p_yes_diff": p_yes_diff.max()})
+    report = pd.DataFrame(rows)
+    print(report.to_string(index=False))
+    if output_path:
+        report.to_csv(output_path, index=False)
+    return report
+
+
+def result_path(csv_path):
+    return csv_path.replace(".csv", "_result.csv").replace("csv/", "csv/results/")
+
+
+def evaluate_test_files(config, model, csv_paths):
+    """test_model over several csv files in one pass: every distinct question of all files is scored once,
+    and the answers are written back to each file's result csv (and the results store)."""
+    device = config["device"]
+    if config.get("inference_precision", "fp32") != "fp32":
+        config, device = {**config, "device": "cpu"}, "cpu"
+    model = model.to(device).eval()
+    if config.get("inference_precision", "fp32") != "fp32":
+        model = model.for_inference(config["inference_precision"])
+    dfs = [pd.read_csv(csv_path) for csv_path in csv_paths]
+    all_questions = pd.concat([df[["question", "label"]] for df in dfs], ignore_index=True)
+    all_questions["question"] = all_questions["question"].astype(str)
+    questions, inverse = np.unique(all_questions["question"].values, return_inverse=True)
+    print(f"{len(all_questions)} questions in {len(csv_paths)} files, {len(questions)} distinct")
+
+    # The distinct questions go through YesNoDataSet like any test file, token cache included.
+    # Labels are not used for scoring, each question keeps the label of its first occurrence.
+    unique_df = all_questions.drop_duplicates("question").set_index("question").loc[questions].reset_index()
+    data_set = YesNoDataSet(csv_path=None, tokenizer=model.tokenizer, max_length=config["max_length"],
+                            cache_dir=config.get("token_cache_dir"), df=unique_df)
+    temperature = yes_no_temperature(config, model)
+    start = time.time()
+    answers, p_yes = score_yes_no(config, model, data_set, temperature)
+    print(f"Scored {len(questions)} questions in {time.time() - start:.1f}s")
+
+    offset = 0
+    results = dict()
+    for csv_path, df in zip(csv_paths, dfs):
+        rows = inverse[offset: offset + len(df)]
+        offset += len(df)
+        result_df = pd.DataFrame.from_dict({"question": df.question.values, "model_answer": answers[rows],
+                                            "true_answer": df.label.values.astype(str), "p_yes": p_yes[rows]})
+        save_test_results(config, result_df, csv_path, result_path(csv_path))
+        print(f"{csv_path} Accuracy: {np.mean(result_df.model_answer == result_df.true_answer)}")
+        results[csv_path] = result_df
+    return results
+
+
+def save_test_results(config, result_df, csv_path, output_path):
+    result_df.to_csv(output_path)
+    if config.get("results_store"):
+        # Questions of csv/<file>_questions.csv are generated from the entities of csv/<file>.csv.
+        entities_csv_path = csv_path.replace("_questions.csv", ".csv")
+        entities = pd.read_csv(entities_csv_path)["entity"].values if os.path.isfile(entities_csv_path) else ()
+        write_results(result_df, checkpoint_name(config.get("checkpoint")), test_set_name(csv_path),
+                      entities=entities, store_dir=config["results_store"])
+
+
 def test_model(config, model, tokenizer, csv_path, output_path):
     print("Test Model")
     print(config.get("test_data"))
@@ -198,8 +510,26 @@ def test_model(config, model, tokenizer, csv_path, output_path):
     print("Load checkpoint")
     model = model.to(device)
     model.eval()
-    data_set = YesNoDataSet(csv_path=csv_path, tokenizer=tokenizer, max_length=config["max_length"])
-    data_loader = DataLoader(data_set, batch_size=config.get("batch_size"), shuffle=True)
+    if config.get("inference_precision", "fp32") != "fp32":
+        # Quantized and bf16 inference run on CPU.
+        config, device = {**config, "device": "cpu"}, "cpu"
+        model = model.to(device).for_inference(config["inference_precision"])
+    data_set = YesNoDataSet(csv_path=csv_path, tokenizer=tokenizer, max_length=config["max_length"],
+                            cache_dir=config.get("token_cache_dir"))
+    if config.get("scoring") == "logits":
+        temperature = yes_no_temperature(config, model)
+        start = time.time()
+        model_answers, p_yes = score_yes_no(config, model, data_set, temperature)
+        true_answers = data_set.labels.astype(str)
+        accuracy = np.mean(model_answers == true_answers)
+        print(f"Scored {len(data_set)} questions in {time.time() - start:.1f}s")
+        result_df = pd.DataFrame.from_dict({"question": data_set.questions, "model_answer": model_answers,
+                                            "true_answer": true_answers, "p_yes": p_yes})
+        save_test_results(config, result_df, csv_path, output_path)
+        print("Accuracy:", accuracy)
+        return result_df
+
+    data_loader = DataLoader(data_set, batch_size=config.get("batch_size"), shuffle=True, collate_fn=YesNoDataSet.collate)
 
     accuracy = 0.0
     count = 0.0
@@ -211,9 +541,10 @@ def test_model(config, model, tokenizer, csv_path, output_path):
         input_ids = batch["input_ids"].to(device)
         attention_mask = batch["attention_mask"].to(device)
         labels = batch["labels"].to(device)
-        output = model.model.generate(input_ids=input_ids,
-                                              attention_mask=attention_mask,
-                                              max_length=2)
+        with model.autocast():
+            output = model.model.generate(input_ids=input_ids,
+                                          attention_mask=attention_mask,
+                                          max_length=2)
         for idx, answer in enumerate(output):
             model_answer = tokenizer.decode(answer, skip_special_tokens=True, clean_up_tokenization_spaces=True)
             true_answer = tokenizer.decode(labels[idx], skip_special_tokens=True, clean_up_tokenization_spaces=True)
@@ -229,8 +560,9 @@ def test_model(config, model, tokenizer, csv_path, output_path):
                 accuracy += 1
             count += 1
     result_df = pd.DataFrame.from_dict({"question": questions, "model_answer": model_answers, "true_answer": true_answers})
-    result_df.to_csv(output_path)
+    save_test_results(config, result_df, csv_path, output_path)
     print("Accuracy:", accuracy / count)
+    return result_df
 
 
 if __name__ == "__main__":
@@ -259,6 +591,18 @@ if __name__ == "__main__":
         "weight_decay": 0.0,
         "adam_epsilon": 1e-8,
         "warmup_steps": 0,
+        "results_store": "results_store",
+        "token_cache_dir": "cache/tokens",
+        "dynamic_padding": True,
+        "bucket_size": 800,
+        # "logits" compares the Yes/No logits of the first decoder step, "generate" decodes the answer.
+        "scoring": "logits",
+        # Temperature of the P(Yes) calibration, None fits it on dev_data (saved next to the checkpoint).
+        "temperature": None,
+        # Number of dev_data questions the temperature is fitted on.
+        "temperature_samples": 2000,
+        # "int8" or "bf16" for faster CPU evaluation, check the drift with precision_drift_report first.
+        "inference_precision": "fp32",
     }
 
     print("Start Run")
@@ -280,5 +624,8 @@ if __name__ == "__main__":
             checkpoint = torch.load(config.get("checkpoint"), map_location=torch.device(config.get("device")))
             model.load_state_dict(checkpoint)
 
-        for f in config["test_data"]:
-            test_model(config, model, tokenizer, output_path=f.replace(".csv", "_result.csv").replace("csv/", "csv/results/"), csv_path=f)
+        if config.get("scoring") == "logits":
+            evaluate_test_files(config, model, config["test_data"])
+        else:
+            for f in config["test_data"]:
+                test_model(config, model, tokenizer, output_path=result_path(f), csv_path=f)
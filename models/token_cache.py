@@ -0,0 +1,66 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+TOKEN_ARRAYS = ("input_ids", "attention_mask", "labels")
+META_FILE = "meta.json"
+
+
+def cache_key(df, tokenizer, max_length):
+    """Hash of the questions and labels of df, the tokenizer (class, name and vocabulary size) and max_length."""
+    digest = hashlib.md5()
+    digest.update(pd.util.hash_pandas_object(df[["question", "label"]], index=False).values.tobytes())
+    tokenizer_id = f"{type(tokenizer).__name__}|{getattr(tokenizer, 'name_or_path', '')}|{len(tokenizer)}"
+    digest.update(f"|{tokenizer_id}|{max_length}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _encode(tokenizer, texts, max_length):
+    encoded = tokenizer(list(texts), max_length=max_length, padding="max_length", truncation=True)
+    return np.asarray(encoded["input_ids"], dtype=np.int32), np.asarray(encoded["attention_mask"], dtype=np.int32)
+
+
+def build_token_cache(df, tokenizer, max_length, cache_dir="cache/tokens", batch_size=4096, source=None):
+    """Tokenizes every question and label of df once into int32 .npy arrays under cache_dir/<cache_key>,
+    returns that directory. An existing cache for the same key is reused. source, the csv df was read from
+    if any, is only recorded in the meta file."""
+    output_dir = os.path.join(cache_dir, cache_key(df, tokenizer, max_length))
+    if os.path.isfile(os.path.join(output_dir, META_FILE)):
+        return output_dir
+
+    tmp_dir = f"{output_dir}.tmp{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    arrays = {name: np.lib.format.open_memmap(os.path.join(tmp_dir, f"{name}.npy"), mode="w+", dtype=np.int32,
+                                              shape=(len(df), max_length)) for name in TOKEN_ARRAYS}
+    questions = df.question.values
+    for start in range(0, len(questions), batch_size):
+        input_ids, attention_mask = _encode(tokenizer, questions[start: start + batch_size], max_length)
+        arrays["input_ids"][start: start + len(input_ids)] = input_ids
+        arrays["attention_mask"][start: start + len(input_ids)] = attention_mask
+    # There are only two labels, each distinct one is tokenized once and copied to its rows.
+    label_values, label_rows = np.unique(df.label.values.astype(str), return_inverse=True)
+    label_ids, _ = _encode(tokenizer, [label + " </s>" for label in label_values], max_length)
+    arrays["labels"][:] = label_ids[label_rows]
+    for array in arrays.values():
+        array.flush()
+    del arrays
+    with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+        json.dump({"source": source, "num_of_rows": len(df), "max_length": max_length,
+                   "tokenizer": getattr(tokenizer, "name_or_path", ""), "pad_token_id": tokenizer.pad_token_id}, f)
+
+    try:
+        os.replace(tmp_dir, output_dir)
+    except OSError:
+        # Another process built the same cache first.
+        shutil.rmtree(tmp_dir)
+    print(f"Token cache for {source or f'{len(df)} questions'}: {output_dir}")
+    return output_dir
+
+
+def load_token_cache(output_dir):
+    """The cached arrays as copy-on-write memory maps: slices are views of the page cache (and can be wrapped by
+    torch.from_numpy without a copy), while writes to them never reach the files."""
+    return {name: np.load(os.path.join(output_dir, f"{name}.npy"), mmap_mode="c") for name in TOKEN_ARRAYS}
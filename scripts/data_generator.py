@@ -12,10 +12,15 @@ import json
 from nltk.corpus import wordnet as wn
 from scripts.wordnet_parser import WordNetObj
 from scripts.concept_net import ConceptNetObj
+from scripts.results_store import RESULTS_STORE, checkpoint_name, test_set_name, write_results, write_results_by_animal
 from itertools import permutations, combinations
 from collections import defaultdict
 import time
 import os
+from wikipedia.entity_matcher import WORD_BOUNDARIES, compile_lexicon
+
+# Questions name an animal as " <entity> ", " <entity>'s " or before punctuation, as in " <entity>?".
+QUESTION_BOUNDARIES = WORD_BOUNDARIES
 
 # model_name = 'roberta-large'
 # mc_mlm = True
@@ -186,8 +191,15 @@ def split_data(csv_path, prefix="", p=0.8):
     print("Number of questions", N)
 
 
-def animal_accuracy(animal, result_df):
-    animal_df = result_df[[f" {animal} " in question or f" {animal}'s" in question for question in result_df.question]]
+def question_animals(questions, animals):
+    """The set of animals each question mentions, from one pass of the compiled animal lexicon."""
+    matcher = compile_lexicon(animals, forms=("possessive",), boundaries=QUESTION_BOUNDARIES)
+    return [set(matcher.find_all(f"{question} ")) for question in questions]
+
+
+def animal_accuracy(animal, result_df, mentioned=None):
+    mentioned = mentioned if mentioned is not None else question_animals(result_df.question, [animal])
+    animal_df = result_df[[animal in animals for animals in mentioned]]
     accuracy = len(animal_df[animal_df.model_answer == animal_df.true_answer]) / len(animal_df)
     yes_count = len(animal_df[animal_df.model_answer == "Yes"])
     no_count = len(animal_df[animal_df.model_answer == "No"])
@@ -296,9 +308,10 @@ def filter_questions():
 
 def aggregate_results_by_animal(result_df, animals_df):
     animals = animals_df["entity"].values
+    mentioned = question_animals(result_df.question, animals)
     results_by_animal = {"animal": [], "accuracy": [], "yes_count": [], "no_count": []}
     for animal in animals:
-        animal, accuracy, yes_count, no_count = animal_accuracy(animal, result_df)
+        animal, accuracy, yes_count, no_count = animal_accuracy(animal, result_df, mentioned)
         results_by_animal["animal"].append(animal)
         results_by_animal["accuracy"].append(accuracy)
         results_by_animal["yes_count"].append(yes_count)
@@ -337,7 +350,9 @@ def aggregate_results_by_question(result_df, animals_df):
     return pd.DataFrame.from_dict(results_by_question)
 
 
-def summarize_results(animals_csv_path, results_csv_path):
+def summarize_results(animals_csv_path, results_csv_path, checkpoint, store_dir=RESULTS_STORE):
+    """checkpoint is the config["checkpoint"] test_model ran with (None for the pretrained model),
+    so the store keys the summary like test_model keys the run."""
     animals_df = pd.read_csv(animals_csv_path)
     result_df = pd.read_csv(results_csv_path)
     results_by_animal = aggregate_results_by_animal(result_df, animals_df)
@@ -345,6 +360,11 @@ def summarize_results(animals_csv_path, results_csv_path):
     results_by_animal.sort_values(axis=0, by=["accuracy"])
     results_by_animal.to_csv(results_csv_path.replace(".csv", "_by_animal.csv"))
     results_by_question.to_csv(results_csv_path.replace(".csv", "_by_question.csv"))
+    if store_dir:
+        test_set = test_set_name(results_csv_path)
+        checkpoint = checkpoint_name(checkpoint)
+        write_results(result_df, checkpoint, test_set, entities=animals_df["entity"].values, store_dir=store_dir)
+        write_results_by_animal(results_by_animal, checkpoint, test_set, store_dir=store_dir)
 
 
 def plot_df(csv_path, output_path=""):
@@ -375,7 +395,7 @@ def plot_df(csv_path, output_path=""):
     plt.close()
 
 
-def run_summarize_results():
+def run_summarize_results(checkpoint):
     files = ["animals_have_a_beak", "animals_have_horns", "animals_have_fins",
              "animals_have_wings", "animals_have_feathers", "animals_have_fur",
              "animals_have_hair", "animals_live_underwater", "animals_can_fly",
@@ -386,7 +406,7 @@ def run_summarize_results():
     for file in files:
         print(f"summarize {file}")
         summarize_results(animals_csv_path=f"../csv/{file}.csv",
-                          results_csv_path=f"../csv/results/{file}_questions_result.csv")
+                          results_csv_path=f"../csv/results/{file}_questions_result.csv", checkpoint=checkpoint)
 
 
 def run_generate_questions():
@@ -405,4 +425,5 @@ def run_generate_questions():
 
 
 if __name__ == "__main__":
-    run_summarize_results()
\ No newline at end of file
+    # The checkpoint of models/qa_models.py's config that produced csv/results.
+    run_summarize_results(checkpoint="checkpoint/checkpoint-epoch=0-steps=11788.ckpt")
\ No newline at end of file
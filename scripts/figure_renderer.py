@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import hashlib
+import importlib
+import importlib.util
+import multiprocessing
+
+# A figure spec is a dict:
+#   "function": "module:function" that draws the figure and saves it to its output_path kwarg.
+#   "kwargs": keyword arguments for the function, output_path included.
+#   "inputs": files or dirs the figure is drawn from; the figure is redrawn when any of them changes.
+#   "cwd": directory to run the function from, e.g. "wikipedia" for its relative ../csv paths (default ".").
+
+
+def _path_hash(path, md5):
+    if os.path.isdir(path):
+        for dir, _, files in sorted(os.walk(path)):
+            for file in sorted(files):
+                _path_hash(os.path.join(dir, file), md5)
+    elif os.path.isfile(path):
+        md5.update(path.encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                md5.update(block)
+    else:
+        md5.update(f"missing:{path}".encode("utf-8"))
+
+
+def _in_spec_dir(spec, path):
+    return os.path.join(spec.get("cwd", "."), path)
+
+
+def spec_hash(spec):
+    md5 = hashlib.md5()
+    md5.update(json.dumps([spec["function"], spec.get("kwargs", dict())], sort_keys=True, default=str).encode("utf-8"))
+    for path in spec.get("inputs", []):
+        _path_hash(_in_spec_dir(spec, path), md5)
+    # The drawing code is an input too.
+    module_name = spec["function"].split(":")[0]
+    sys.path.insert(0, os.path.abspath(spec.get("cwd", ".")))
+    try:
+        module_spec = importlib.util.find_spec(module_name)
+    finally:
+        sys.path.pop(0)
+    if module_spec is not None and module_spec.origin and os.path.isfile(module_spec.origin):
+        _path_hash(module_spec.origin, md5)
+    return md5.hexdigest()
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def render_figure(spec):
+    cwd = os.getcwd()
+    spec_dir = os.path.abspath(spec.get("cwd", "."))
+    os.chdir(spec_dir)
+    sys.path.insert(0, spec_dir)
+    try:
+        module_name, function_name = spec["function"].split(":")
+        getattr(importlib.import_module(module_name), function_name)(**spec.get("kwargs", dict()))
+        return spec["kwargs"]["output_path"], None
+    except Exception as e:
+        return spec["kwargs"]["output_path"], repr(e)
+    finally:
+        sys.path.remove(spec_dir)
+        os.chdir(cwd)
+
+
+def render_figures(specs, num_of_workers=None, cache_path="graphs/render_cache.json", force=False):
+    """Renders figure specs to files with the Agg backend in a process pool, skipping unchanged figures."""
+    cache = dict()
+    if os.path.isfile(cache_path) and not force:
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+
+    pending = []
+    hashes = dict()
+    for spec in specs:
+        output_path = spec["kwargs"]["output_path"]
+        hashes[output_path] = spec_hash(spec)
+        if cache.get(output_path) == hashes[output_path] and os.path.isfile(_in_spec_dir(spec, output_path)):
+            continue
+        pending.append(spec)
+    print(f"total figures: {len(specs)} to render: {len(pending)}")
+
+    if pending:
+        with multiprocessing.Pool(processes=min(num_of_workers or os.cpu_count(), len(pending)),
+                                  initializer=_init_worker) as pool:
+            for output_path, error in pool.imap_unordered(render_figure, pending):
+                if error is None:
+                    cache[output_path] = hashes[output_path]
+                    print(f"Rendered {output_path}")
+                else:
+                    cache.pop(output_path, None)
+                    print(f"Failed {output_path}: {error}")
+
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(cache, f, indent=1)
+    return cache
+
+
+def summary_table_specs(files):
+    return [{"function": "scripts.data_generator:plot_df",
+             "kwargs": {"csv_path": f"csv/results/{file}_questions_result_by_animal.csv",
+                        "output_path": f"graphs/tables/{file}_by_animal.jpg"},
+             "inputs": [f"csv/results/{file}_questions_result_by_animal.csv"]} for file in files]
+
+
+def wikipedia_plot_specs():
+    results = ["../csv/results", "../results_store"]
+    return [
+        {"function": "wikipedia_graph_plotter:plot_occurrence_by_animal",
+         "kwargs": {"output_path": "../graphs/wikipedia/occurrence_by_animal.jpg"},
+         "inputs": results + ["wiki_unigram_table"], "cwd": "wikipedia"},
+        {"function": "wikipedia_graph_plotter:plot_occurrence_by_property",
+         "kwargs": {"exact": True, "output_path": "../graphs/wikipedia/occurrence_by_property.jpg"},
+         "inputs": results + ["wiki_unigram_table"], "cwd": "wikipedia"},
+        {"function": "wikipedia_graph_plotter:plot_cooccurrence",
+         "kwargs": {"output_path": "../graphs/wikipedia/cooccurrence.jpg"},
+         "inputs": results + ["wiki_cooccurrence.npz"], "cwd": "wikipedia"},
+    ]
+
+
+if __name__ == "__main__":
+    os.makedirs("graphs/wikipedia", exist_ok=True)
+    os.makedirs("graphs/tables", exist_ok=True)
+    render_figures(wikipedia_plot_specs() + summary_table_specs(
+        ["animals_have_a_beak", "animals_have_horns", "animals_have_fins", "animals_have_wings",
+         "animals_have_feathers", "animals_have_fur", "animals_have_hair", "animals_live_underwater",
+         "animals_can_fly", "animals_dont_have_a_beak", "animals_dont_have_horns", "animals_dont_have_fins",
+         "animals_dont_have_wings", "animals_dont_have_feathers", "animals_dont_have_fur",
+         "animals_dont_have_hair", "animals_dont_live_underwater", "animals_cant_fly"]))
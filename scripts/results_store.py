@@ -0,0 +1,121 @@
+import os
+import operator
+from functools import lru_cache
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+RESULTS_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "results_store")
+PARTITION_COLUMNS = ["checkpoint", "test_set"]
+QA_SCHEMA = pa.schema([
+    ("checkpoint", pa.dictionary(pa.int32(), pa.string())),
+    ("test_set", pa.dictionary(pa.int32(), pa.string())),
+    ("question", pa.dictionary(pa.int32(), pa.string())),
+    ("entity", pa.dictionary(pa.int32(), pa.string())),
+    ("template", pa.dictionary(pa.int32(), pa.string())),
+    ("model_answer", pa.dictionary(pa.int8(), pa.string())),
+    ("true_answer", pa.dictionary(pa.int8(), pa.string())),
+    ("p_yes", pa.float32()),
+])
+BY_ANIMAL_SCHEMA = pa.schema([
+    ("checkpoint", pa.dictionary(pa.int32(), pa.string())),
+    ("test_set", pa.dictionary(pa.int32(), pa.string())),
+    ("animal", pa.dictionary(pa.int32(), pa.string())),
+    ("accuracy", pa.float32()),
+    ("yes_count", pa.int32()),
+    ("no_count", pa.int32()),
+])
+FILTER_OPS = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt,
+              ">=": operator.ge, "in": lambda field, values: field.isin(list(values))}
+
+
+def test_set_name(csv_path):
+    """csv/animals_can_fly_questions.csv and csv/results/animals_can_fly_questions_result.csv
+    are both the animals_can_fly_questions test set."""
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return name[:-len("_result")] if name.endswith("_result") else name
+
+
+def checkpoint_name(checkpoint_path):
+    return os.path.basename(checkpoint_path) if checkpoint_path else "pretrained"
+
+
+def split_question(question, entities):
+    """Returns (entity, template) for a question built from a "<entity>" template, or (None, None)."""
+    for entity in entities:
+        for surface in (f" {entity} ", f" {entity}'s"):
+            if surface in question:
+                return entity, question.replace(surface, surface.replace(entity, "<entity>"), 1)
+    return None, None
+
+
+def _write_partition(df, schema, dataset, checkpoint, test_set, store_dir):
+    df = df.copy()
+    df["checkpoint"] = checkpoint
+    df["test_set"] = test_set
+    table = pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+    partitioning = ds.partitioning(pa.schema([schema.field(column) for column in PARTITION_COLUMNS]), flavor="hive")
+    ds.write_dataset(table, os.path.join(store_dir, dataset), format="parquet", partitioning=partitioning,
+                     existing_data_behavior="delete_matching", basename_template="part-{i}.parquet")
+    _load.cache_clear()
+
+
+def write_results(result_df, checkpoint, test_set, entities=(), store_dir=RESULTS_STORE):
+    """Stores one test_model run, replacing any earlier run of the same (checkpoint, test_set)."""
+    result_df = result_df.copy()
+    entities = sorted(entities, key=len, reverse=True)
+    split = [split_question(question, entities) for question in result_df["question"]]
+    result_df["entity"] = [entity for entity, template in split]
+    result_df["template"] = [template for entity, template in split]
+    if "p_yes" not in result_df:
+        result_df["p_yes"] = None
+    _write_partition(result_df, QA_SCHEMA, "qa", checkpoint, test_set, store_dir)
+
+
+def write_results_by_animal(by_animal_df, checkpoint, test_set, store_dir=RESULTS_STORE):
+    by_animal_df = by_animal_df.astype({"accuracy": "float32", "yes_count": "int32", "no_count": "int32"})
+    _write_partition(by_animal_df, BY_ANIMAL_SCHEMA, "by_animal", checkpoint, test_set, store_dir)
+
+
+def _as_key(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_as_key(v) for v in value)
+    return value
+
+
+def _to_expression(filters):
+    expression = None
+    for column, op, value in filters:
+        condition = FILTER_OPS[op](ds.field(column), value)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+@lru_cache(maxsize=32)
+def _load(store_dir, dataset, columns, filters):
+    path = os.path.join(store_dir, dataset)
+    if not os.path.isdir(path):
+        return pd.DataFrame(columns=list(columns) if columns else None)
+    table = ds.dataset(path, format="parquet", partitioning="hive").to_table(
+        columns=list(columns) if columns else None, filter=_to_expression(filters) if filters else None)
+    return table.to_pandas()
+
+
+def load_results(columns=None, filters=None, store_dir=RESULTS_STORE):
+    """Loads QA results, reading only the given columns and the partitions/rows matching
+    filters, e.g. [("test_set", "in", ["animals_have_fins_questions"]), ("entity", "==", "shark")]."""
+    return _load(store_dir, "qa", _as_key(columns), _as_key(filters)).copy()
+
+
+def load_results_by_animal(test_set, checkpoint=None, store_dir=RESULTS_STORE):
+    """Per-animal results of test_set. Without a checkpoint the store must hold a single one for test_set,
+    rows of different models are never mixed."""
+    filters = [("test_set", "==", test_set)] + ([("checkpoint", "==", checkpoint)] if checkpoint else [])
+    df = _load(store_dir, "by_animal", ("checkpoint", "animal", "accuracy", "yes_count", "no_count"),
+               _as_key(filters)).copy()
+    checkpoints = sorted(df["checkpoint"].astype(str).unique())
+    if len(checkpoints) > 1:
+        raise ValueError(f"{test_set} has results of checkpoints {checkpoints} in {store_dir}, pass checkpoint")
+    df = df.drop(columns="checkpoint")
+    df["animal"] = df["animal"].astype(str)
+    return df
@@ -0,0 +1,81 @@
+import os
+import shutil
+import pytest
+
+WIKIPEDIA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "wikipedia")
+SAMPLE_SHARDS = os.path.join(WIKIPEDIA_DIR, "text", "AA")
+WORDS = ["water", "fly", "fur", "bird"]
+NEW_DOC = '<doc id="999999" url="?curid=999999" title="Added">\nAdded\n\nBirds fly over the water, water and fur.\n</doc>\n'
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """A copy of the sample shards in tmp_path, which is also the working directory."""
+    monkeypatch.syspath_prepend(WIKIPEDIA_DIR)
+    shutil.copytree(SAMPLE_SHARDS, tmp_path / "text" / "AA")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def append_doc(corpus, shard="wiki_01"):
+    with open(corpus / "text" / "AA" / shard, "a") as f:
+        f.write(NEW_DOC)
+
+
+def sentence_windows(xml_paths, words, sent_length=512):
+    """The windows the sentence pass stores for words, read straight from the shards."""
+    from wiki_reader import iter_docs
+    from entity_matcher import compile_lexicon
+    matcher = compile_lexicon(words)
+    windows = {word: [] for word in words}
+    for xml_path in xml_paths:
+        for doc_id, title, text in iter_docs(xml_path):
+            text = text.lower()
+            for word, idx in matcher.finditer(text):
+                windows[word].append(text[max(0, idx - sent_length): idx + sent_length])
+    return windows
+
+
+def test_changed_shard_keeps_its_sentences(corpus):
+    import wikipedia_parser
+    from chunk_store import ChunkStore
+
+    def run():
+        wikipedia_parser.run_collect_sentences_with_words(num_of_workers=2, words=WORDS)
+        store = ChunkStore("wiki_word_to_sentences.pkl", num_partitions=wikipedia_parser.NUM_PARTITIONS)
+        expected = sentence_windows(wikipedia_parser.find_wiki_shards(), WORDS)
+        # Runs are merged in manifest order, not shard order.
+        assert {word: sorted(store.texts(word)) for word in WORDS} == \
+            {word: sorted(windows) for word, windows in expected.items()}
+        return expected
+
+    before = run()
+    append_doc(corpus)
+    after = run()
+    assert len(after["water"]) > len(before["water"])
+
+
+def test_changed_shard_keeps_its_unigram_counts(corpus):
+    import wikipedia_parser
+    from collections import Counter
+    from shard_manifest import ShardManifest, output_files
+
+    def run():
+        counts = wikipedia_parser.compute_unigram(num_of_workers=2)
+        expected = Counter()
+        for xml_path in wikipedia_parser.find_wiki_shards():
+            for doc_id, title, text in wikipedia_parser.iter_docs(xml_path):
+                expected.update(wikipedia_parser.tokenize(text))
+        assert counts == expected
+        # Only the spills of the current shard contents are left, the stale ones were deleted.
+        manifest = ShardManifest("wiki_manifest.json", task="unigram")
+        spills = {os.path.join(corpus, path) for entry in manifest.shards.values() for output in entry["outputs"]
+                  for path in output_files(output)}
+        parts_dir = corpus / "wiki_unigram_parts"
+        assert {str(parts_dir / name) for name in os.listdir(parts_dir) if not name.startswith("unigram.")} == spills
+        return expected
+
+    before = run()
+    append_doc(corpus)
+    after = run()
+    assert sum(after.values()) > sum(before.values())
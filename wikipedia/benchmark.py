@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import multiprocessing
+from synthetic_corpus import generate_corpus, DEFAULT_ENTITIES
+from wiki_reader import iter_docs
+from sorted_runs import partition_path
+import wikipedia_parser
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS.
+    scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale / 2 ** 20
+
+
+def _run_measured(fn, kwargs, cwd, connection):
+    os.chdir(cwd)
+    start = time.perf_counter()
+    try:
+        fn(**kwargs)
+        error = None
+    except Exception as e:
+        error = repr(e)
+    connection.send({"seconds": time.perf_counter() - start, "peak_rss_mb": _peak_rss_mb(), "error": error})
+    connection.close()
+
+
+def measure(fn, kwargs=None, cwd=".", timeout=None):
+    """Runs fn(**kwargs) in a fresh process, so peak RSS (the process and its pool workers) is this run's alone.
+    A process that dies (or runs past timeout seconds) gives a result with an error instead of blocking."""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_measured, args=(fn, kwargs or dict(), cwd, sender))
+    start = time.perf_counter()
+    process.start()
+    sender.close()
+    result, timed_out = None, False
+    while result is None:
+        if receiver.poll(1):
+            try:
+                result = receiver.recv()
+            except EOFError:
+                # Only the child held the sending end, it exited without a result.
+                break
+        elif not process.is_alive():
+            break
+        elif timeout is not None and time.perf_counter() - start > timeout:
+            timed_out = True
+            process.terminate()
+            break
+    process.join()
+    if result is None:
+        error = f"timed out after {timeout}s" if timed_out else f"process exited with code {process.exitcode}"
+        result = {"seconds": time.perf_counter() - start, "peak_rss_mb": float("nan"), "error": error}
+    return result
+
+
+def find_words_in_corpus(shard_paths, words):
+    for xml_path in shard_paths:
+        for doc_id, title, text in iter_docs(xml_path):
+            text = text.lower()
+            for word in words:
+                wikipedia_parser.find_word_in_text(word, text)
+
+
+def _reset(work_dir, paths):
+    for path in paths:
+        path = os.path.join(work_dir, path)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        for candidate in [path] + [partition_path(path, partition, wikipedia_parser.NUM_PARTITIONS)
+                                   for partition in range(wikipedia_parser.NUM_PARTITIONS)]:
+            if os.path.isfile(candidate):
+                os.remove(candidate)
+
+
+def run_benchmarks(output_path="wiki_benchmark.json", work_dir=None, num_of_workers=None, num_shards=8,
+                   shard_bytes=2 ** 20, vocab_size=50000, zipf_exponent=1.1, entity_rate=0.002,
+                   entities=DEFAULT_ENTITIES, seed=0, timeout=None):
+    """Times the wiki pipeline stages on a synthetic corpus and writes docs/s, MB/s and peak RSS as json."""
+    work_dir = work_dir or tempfile.mkdtemp(prefix="wiki_benchmark_")
+    corpus_params = {"num_shards": num_shards, "shard_bytes": shard_bytes, "vocab_size": vocab_size,
+                     "zipf_exponent": zipf_exponent, "entity_rate": entity_rate, "num_entities": len(entities),
+                     "seed": seed}
+    shard_paths = generate_corpus(os.path.join(work_dir, "text"), num_shards=num_shards, shard_bytes=shard_bytes,
+                                  vocab_size=vocab_size, zipf_exponent=zipf_exponent, entities=entities,
+                                  entity_rate=entity_rate, seed=seed)
+    corpus_bytes = sum(os.path.getsize(path) for path in shard_paths)
+    num_docs = sum(1 for path in shard_paths for _ in iter_docs(path))
+    print(f"corpus: {num_shards} shards {corpus_bytes / 2 ** 20:.1f} MB {num_docs} docs in {work_dir}")
+
+    sentences = {"num_of_workers": num_of_workers, "words": entities, "parts_dir": "bench_chunks",
+                 "manifest_path": "bench_manifest.json", "output_path": "bench_word_to_sentences.pkl",
+                 "combine": False}
+    benchmarks = [
+        ("find_word_in_text", find_words_in_corpus, {"shard_paths": shard_paths, "words": entities}, []),
+        ("compute_unigram", wikipedia_parser.compute_unigram,
+         {"num_of_workers": num_of_workers, "output_path": "bench_unigram.pkl", "table_dir": "bench_unigram_table",
+          "parts_dir": "bench_unigram_parts", "manifest_path": "bench_manifest.json"},
+         ["bench_manifest.json", "bench_unigram.pkl", "bench_unigram_table", "bench_unigram_parts"]),
+        ("collect_sentences_with_words", wikipedia_parser.run_collect_sentences_with_words, sentences,
+         ["bench_manifest.json", "bench_chunks", "bench_word_to_sentences.pkl"]),
+        # Collection leaves the sentence runs uncombined, this stage merges them.
+        ("combine_wiki_threads", wikipedia_parser.combine_wiki_threads,
+         {"output_path": "bench_word_to_sentences.pkl", "manifest_path": "bench_manifest.json",
+          "num_of_workers": num_of_workers}, ["bench_word_to_sentences.pkl"]),
+    ]
+
+    results = []
+    for name, fn, kwargs, outputs in benchmarks:
+        _reset(work_dir, outputs)
+        result = measure(fn, kwargs, cwd=work_dir, timeout=timeout)
+        result.update({"benchmark": name, "docs": num_docs, "bytes": corpus_bytes,
+                       "docs_per_s": num_docs / result["seconds"],
+                       "mb_per_s": corpus_bytes / 2 ** 20 / result["seconds"]})
+        print(f"{name}: {result['seconds']:.2f}s {result['docs_per_s']:.0f} docs/s {result['mb_per_s']:.2f} MB/s "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB" + (f" error {result['error']}" if result["error"] else ""))
+        results.append(result)
+
+    report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "platform": platform.platform(), "cpu_count": os.cpu_count(), "num_of_workers": num_of_workers,
+              "corpus": corpus_params, "results": results}
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+def compare_benchmarks(baseline_path, current_path):
+    """Prints the speedup of every benchmark in current over baseline (> 1 is faster)."""
+    with open(baseline_path, "r") as f:
+        baseline = {result["benchmark"]: result for result in json.load(f)["results"]}
+    with open(current_path, "r") as f:
+        current = {result["benchmark"]: result for result in json.load(f)["results"]}
+    for name in current:
+        if name in baseline:
+            print(f"{name}: {baseline[name]['seconds'] / current[name]['seconds']:.2f}x "
+                  f"peak RSS {baseline[name]['peak_rss_mb']:.0f} -> {current[name]['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    run_benchmarks()
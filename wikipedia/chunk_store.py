@@ -0,0 +1,116 @@
+import os
+import json
+import mmap
+import numpy as np
+from entity_matcher import compile_lexicon
+from wiki_reader import iter_docs
+from sorted_runs import load_word_chunks
+
+# start/end are byte offsets into the corpus file of shard_id.
+CHUNK_DTYPE = np.dtype([("shard_id", "<u4"), ("doc_id", "<u4"), ("start", "<u8"), ("end", "<u8")])
+
+
+def char_to_byte_offsets(text, char_offsets):
+    if text.isascii():
+        return list(char_offsets)
+    byte_offsets = dict()
+    last_char, last_byte = 0, 0
+    for char_offset in sorted(set(char_offsets)):
+        last_byte += len(text[last_char: char_offset].encode("utf-8"))
+        last_char = char_offset
+        byte_offsets[char_offset] = last_byte
+    return [byte_offsets[char_offset] for char_offset in char_offsets]
+
+
+def _open_corpus(corpus_path):
+    with open(corpus_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def collect_chunks_in_shard(xml_path, shard_id, words, corpus_path, sent_length=512):
+    """Returns {word: CHUNK_DTYPE array} of the windows around every hit in xml_path. Offsets point into
+    corpus_path, the lowercased text of the shard's docs, which is written once per shard content."""
+    matcher = compile_lexicon(words)
+    chunks = {word: [] for word in words}
+    write_corpus = not os.path.isfile(corpus_path)
+    tmp_path = f"{corpus_path}.tmp{os.getpid()}"
+    offset = 0
+    try:
+        with open(tmp_path if write_corpus else os.devnull, "wb") as corpus:
+            for doc_id, title, text in iter_docs(xml_path):
+                text = text.lower()
+                encoded = text.encode("utf-8")
+                if write_corpus:
+                    corpus.write(encoded)
+                hits = list(matcher.finditer(text))
+                if hits:
+                    doc_id = int(doc_id) if doc_id.isdigit() else 0
+                    bounds = [max(0, idx - sent_length) for word, idx in hits] + \
+                             [min(len(text), idx + sent_length) for word, idx in hits]
+                    byte_bounds = char_to_byte_offsets(text, bounds)
+                    for i, (word, idx) in enumerate(hits):
+                        chunks[word].append((shard_id, doc_id, offset + byte_bounds[i],
+                                             offset + byte_bounds[i + len(hits)]))
+                offset += len(encoded)
+    except Exception:
+        if write_corpus and os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if write_corpus:
+        os.replace(tmp_path, corpus_path)
+    return {word: np.array(records, dtype=CHUNK_DTYPE) for word, records in chunks.items() if records}
+
+
+def corpus_paths_file(path):
+    """The {shard_id: corpus path} json written next to a combined chunk artifact."""
+    return f"{os.path.splitext(path)[0]}_shards.json"
+
+
+class ChunkStore:
+    """Per-word text windows of a combined chunk artifact, resolved lazily against the memory-mapped
+    per-shard corpus files."""
+
+    def __init__(self, path, num_partitions=1):
+        self.path = path
+        self.num_partitions = num_partitions
+        with open(corpus_paths_file(path), "r") as f:
+            self.corpus_paths = {int(shard_id): corpus_path for shard_id, corpus_path in json.load(f).items()}
+        self.corpora = dict()
+        self.chunks = dict()
+
+    def corpus(self, shard_id):
+        if shard_id not in self.corpora:
+            self.corpora[shard_id] = _open_corpus(self.corpus_paths[shard_id])
+        return self.corpora[shard_id]
+
+    def __contains__(self, word):
+        return len(self[word]) > 0
+
+    def __getitem__(self, word):
+        """The (shard_id, doc_id, start, end) records of a word, only its partition of the artifact is read."""
+        if word not in self.chunks:
+            records = load_word_chunks(self.path, [word], num_partitions=self.num_partitions)
+            self.chunks[word] = records.get(word, np.zeros(0, dtype=CHUNK_DTYPE))
+        return self.chunks[word]
+
+    def count(self, word):
+        return len(self[word])
+
+    def windows(self, word):
+        """Yields zero-copy memoryviews of each window around word."""
+        records = self[word]
+        for shard_id, start, end in zip(records["shard_id"].tolist(), records["start"].tolist(),
+                                        records["end"].tolist()):
+            yield memoryview(self.corpus(shard_id))[start: end]
+
+    def texts(self, word):
+        for window in self.windows(word):
+            yield str(window, "utf-8")
+
+
+if __name__ == "__main__":
+    from wikipedia_parser import NUM_PARTITIONS
+    store = ChunkStore("wiki_word_to_sentences.pkl", num_partitions=NUM_PARTITIONS)
+    print({word: store.count(word) for word in ["water", "fly", "fur"]})
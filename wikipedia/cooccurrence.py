@@ -0,0 +1,158 @@
+import os
+import re
+import multiprocessing
+import numpy as np
+from scipy import sparse
+from entity_matcher import compile_lexicon
+from wiki_reader import iter_docs, shard_progress, shard_size
+
+# Window units: characters, tokens or sentences around the entity hit. "doc" is the whole document.
+WINDOW_UNITS = ("c", "t", "s")
+TOKEN = re.compile(r"""[^ '!?".,;:()\[\]\n]+""")
+SENTENCE_END = re.compile(r"[.!?]\s+|\n+")
+
+_worker_state = dict()
+
+
+def parse_window(window):
+    """Returns (unit, size) for 512 or "512c" (characters), "64t" (tokens), "1s" (sentences),
+    "sentence" (the same sentence) or "document"."""
+    if isinstance(window, (int, np.integer)):
+        return "c", int(window)
+    if window == "document":
+        return "doc", 0
+    if window == "sentence":
+        return "s", 0
+    if window[-1] not in WINDOW_UNITS or not window[:-1].isdigit():
+        raise ValueError(f"Unknown co-occurrence window {window}")
+    return window[-1], int(window[:-1])
+
+
+def window_name(window):
+    unit, size = parse_window(window)
+    return unit if unit == "doc" else f"{size}{unit}"
+
+
+def _init_worker(entities, properties, windows):
+    _worker_state["entities"] = {entity: i for i, entity in enumerate(entities)}
+    _worker_state["properties"] = {prop: i for i, prop in enumerate(properties)}
+    _worker_state["entity_matcher"] = compile_lexicon(entities)
+    _worker_state["property_matcher"] = compile_lexicon(properties)
+    _worker_state["windows"] = [parse_window(window) for window in windows]
+
+
+def _unit_positions(text, unit, offsets, unit_starts):
+    """Maps character offsets to token or sentence indices, from sorted token / sentence start offsets."""
+    if unit == "doc":
+        return np.zeros(len(offsets), dtype=np.int64)
+    if unit not in unit_starts:
+        if unit == "t":
+            unit_starts[unit] = np.array([match.start() for match in TOKEN.finditer(text)], dtype=np.int64)
+        else:
+            unit_starts[unit] = np.array([0] + [match.end() for match in SENTENCE_END.finditer(text)], dtype=np.int64)
+    return np.searchsorted(unit_starts[unit], offsets, side="right") - 1
+
+
+def count_doc_cooccurrence(text, entity_matcher, property_matcher, entity_index, property_index, windows, counts):
+    """Adds the document's (entity, property) window counts for every window to counts[window_num]."""
+    entity_hits = [(entity_index[entity], start) for entity, start in entity_matcher.finditer(text)]
+    if not entity_hits:
+        return
+    property_hits = [[] for _ in property_index]
+    for prop, start, end in property_matcher.finditer_spans(text):
+        property_hits[property_index[prop]].append((start, end))
+    if not any(property_hits):
+        return
+
+    entity_ids = np.array([hit[0] for hit in entity_hits], dtype=np.int64)
+    entity_starts = np.array([hit[1] for hit in entity_hits], dtype=np.int64)
+    hits = [np.array(hits, dtype=np.int64).reshape((-1, 2)) for hits in property_hits]
+    unit_starts, unit_hits = dict(), {"c": (entity_starts, hits)}
+    for window_num, (unit, size) in enumerate(windows):
+        if unit not in unit_hits:
+            # Hits include their boundary characters, the word itself starts one character in.
+            unit_hits[unit] = (_unit_positions(text, unit, entity_starts + 1, unit_starts),
+                               [np.stack([_unit_positions(text, unit, prop_hits[:, 0] + 1, unit_starts),
+                                          _unit_positions(text, unit, prop_hits[:, 1] - 1, unit_starts)], axis=1)
+                                for prop_hits in hits])
+        centers, spans = unit_hits[unit]
+        low, high = centers - size, centers + size
+        for prop_id, prop_spans in enumerate(spans):
+            if not len(prop_spans):
+                continue
+            # A window counts once if any property hit lies fully inside it.
+            # Hits are sorted, so the first hit starting inside the window is found with one sorted sweep.
+            first = np.searchsorted(prop_spans[:, 0], low, side="left")
+            inside = first < len(prop_spans)
+            inside[inside] = prop_spans[first[inside], 1] <= high[inside]
+            np.add.at(counts[window_num][:, prop_id], entity_ids[inside], 1)
+
+
+def count_shard_cooccurrence(xml_path):
+    state = _worker_state
+    counts = np.zeros((len(state["windows"]), len(state["entities"]), len(state["properties"])), dtype=np.int64)
+    for doc_id, title, text in iter_docs(xml_path):
+        count_doc_cooccurrence(text.lower(), state["entity_matcher"], state["property_matcher"], state["entities"],
+                               state["properties"], state["windows"], counts)
+    return [sparse.coo_matrix(window_counts) for window_counts in counts]
+
+
+def _count_shard_job(xml_path):
+    return xml_path, count_shard_cooccurrence(xml_path)
+
+
+def build_cooccurrence_matrix(xml_paths, entities, properties, windows=(512,), num_of_workers=None,
+                              output_path="wiki_cooccurrence.npz"):
+    """Counts (entity, property) co-occurrence for every window in windows (see parse_window) in a single corpus pass,
+    returns ({window name: matrix}, entities, properties)."""
+    entities, properties = sorted(set(entities)), list(properties)
+    names = [window_name(window) for window in windows]
+    num_of_workers = num_of_workers or os.cpu_count()
+    print(f"total shards: {len(xml_paths)} entities: {len(entities)} properties: {len(properties)} windows: {names}")
+
+    matrices = [sparse.csr_matrix((len(entities), len(properties)), dtype=np.int64) for _ in names]
+    progress = shard_progress(xml_paths)
+    with multiprocessing.Pool(processes=num_of_workers, initializer=_init_worker,
+                              initargs=(entities, properties, windows)) as pool:
+        for xml_path, shard_counts in pool.imap_unordered(_count_shard_job, xml_paths):
+            matrices = [matrix + counts.tocsr() for matrix, counts in zip(matrices, shard_counts)]
+            progress.update(shard_size(xml_path))
+
+    matrices = dict(zip(names, matrices))
+    save_cooccurrence_matrix(output_path, matrices, entities, properties)
+    print("Done")
+    return matrices, entities, properties
+
+
+def save_cooccurrence_matrix(output_path, matrices, entities, properties):
+    arrays = dict()
+    for name, matrix in matrices.items():
+        matrix = matrix.tocsr()
+        arrays.update({f"{name}_data": matrix.data, f"{name}_indices": matrix.indices, f"{name}_indptr": matrix.indptr})
+    np.savez(output_path, shape=(len(entities), len(properties)), entities=np.array(entities),
+             properties=np.array(properties), windows=np.array(list(matrices)), **arrays)
+
+
+def load_cooccurrence_matrix(path="wiki_cooccurrence.npz", window=None):
+    """Returns (matrix, entities, properties) for one window, by default the first one counted."""
+    with np.load(path) as f:
+        if "windows" not in f:
+            # Single window files written before multi-window counting.
+            prefix = ""
+        else:
+            prefix = (window_name(window) if window is not None else str(f["windows"][0])) + "_"
+        matrix = sparse.csr_matrix((f[f"{prefix}data"], f[f"{prefix}indices"], f[f"{prefix}indptr"]),
+                                   shape=tuple(f["shape"]))
+        return matrix, list(f["entities"]), list(f["properties"])
+
+
+def cooccurrence_windows(path="wiki_cooccurrence.npz"):
+    with np.load(path) as f:
+        return [str(name) for name in f["windows"]] if "windows" in f else [window_name(int(f["window"]))]
+
+
+if __name__ == "__main__":
+    from wikipedia_parser import find_wiki_shards, collect_all_entities
+    from wikipedia_graph_plotter import COOCCURRENCE_PROPERTIES
+    build_cooccurrence_matrix(find_wiki_shards(), collect_all_entities(), COOCCURRENCE_PROPERTIES,
+                              windows=(512, 64, 128, 256, "32t", "sentence", "document"))
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+class CooccurrenceThresholdClassifier:
+    """Predicts a "Yes" answer when the (entity, property) co-occurrence count is above a learned threshold."""
+
+    def __init__(self):
+        self.threshold = None
+        self.accuracy = None
+
+    def fit(self, co_occurrence, answers):
+        co_occurrence = np.asarray(co_occurrence)
+        answers = np.asarray(answers) == 1
+        order = np.argsort(co_occurrence, kind="stable")
+        sorted_counts, sorted_answers = co_occurrence[order], answers[order]
+        thresholds = np.unique(sorted_counts)
+        # Predicting Yes for count > th is right for every No at or below th and every Yes above it.
+        num_at_or_below = np.searchsorted(sorted_counts, thresholds, side="right")
+        no_at_or_below = np.cumsum(~sorted_answers)[num_at_or_below - 1]
+        yes_above = sorted_answers.sum() - np.cumsum(sorted_answers)[num_at_or_below - 1]
+        accuracies = (no_at_or_below + yes_above) / len(sorted_answers)
+        best = int(np.argmax(accuracies))
+        self.threshold, self.accuracy = thresholds[best], accuracies[best]
+        return self
+
+    def predict(self, co_occurrence):
+        return (np.asarray(co_occurrence) > self.threshold).astype(int)
+
+    def score(self, co_occurrence, answers):
+        return np.mean(self.predict(co_occurrence) == (np.asarray(answers) == 1))
+
+
+def roc_curve(co_occurrence, answers):
+    """False and true positive rates for every distinct threshold, with "Yes" as the positive class."""
+    co_occurrence = np.asarray(co_occurrence)
+    answers = np.asarray(answers) == 1
+    order = np.argsort(-co_occurrence, kind="stable")
+    sorted_counts, sorted_answers = co_occurrence[order], answers[order]
+    last_of_value = np.r_[np.nonzero(np.diff(sorted_counts))[0], len(sorted_counts) - 1]
+    true_positives = np.cumsum(sorted_answers)[last_of_value]
+    false_positives = np.cumsum(~sorted_answers)[last_of_value]
+    tpr = np.r_[0, true_positives] / max(answers.sum(), 1)
+    fpr = np.r_[0, false_positives] / max((~answers).sum(), 1)
+    return fpr, tpr, sorted_counts[last_of_value]
+
+
+def auc(fpr, tpr):
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2.))
+
+
+def log_binned_curve(co_occurrence, answers):
+    """Yes rate per power-of-two co-occurrence bin, counts up to 2 falling in the first bin."""
+    co_occurrence = np.asarray(co_occurrence, dtype=np.float64)
+    answers = np.asarray(answers, dtype=np.float64)
+    max_power = int(np.ceil(np.log2(max(np.max(co_occurrence), 1))))
+    bins = np.array([2 ** i for i in range(max_power + 1)])
+    bin_index = np.zeros(len(co_occurrence), dtype=np.int64)
+    above = co_occurrence > 2
+    bin_index[above] = np.floor(np.log2(co_occurrence[above])).astype(np.int64)
+    counts = np.bincount(bin_index, minlength=len(bins))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        yes_rate = np.bincount(bin_index, weights=answers, minlength=len(bins)) / counts
+    return bins, counts, yes_rate
@@ -0,0 +1,139 @@
+import re
+from collections import deque
+from functools import lru_cache
+
+# Same boundary rules as wikipedia_parser.find_word_in_text: (prefix, suffix) around the word.
+BOUNDARIES = [(" ", " "), (" ", "."), (" ", "s "), (" ", ":"), ('"', '"'), (" ", "?"), (" ", "-"), (" ", ","),
+              (" ", ";")]
+# Boundaries for compiled lexicons, where plurals are surface variants rather than an "s " suffix.
+WORD_BOUNDARIES = [boundary for boundary in BOUNDARIES if boundary != (" ", "s ")]
+VARIANT_FORMS = ("separator", "plural", "possessive")
+SEPARATORS = re.compile("[ _-]")
+IRREGULAR_PLURALS = {"mouse": "mice", "louse": "lice", "goose": "geese", "ox": "oxen", "child": "children",
+                     "foot": "feet", "tooth": "teeth", "wolf": "wolves", "calf": "calves", "half": "halves",
+                     "leaf": "leaves", "wife": "wives", "knife": "knives", "life": "lives", "person": "people",
+                     "cactus": "cacti", "fungus": "fungi", "larva": "larvae", "sheep": "sheep", "deer": "deer",
+                     "fish": "fish", "moose": "moose", "bison": "bison", "salmon": "salmon", "trout": "trout",
+                     "squid": "squid", "shrimp": "shrimp"}
+
+
+def plural(word):
+    """English plural of the last word of word, with the usual -es / -ies rules and a few irregular animal plurals."""
+    last = SEPARATORS.split(word)[-1]
+    head = word[:len(word) - len(last)]
+    if last in IRREGULAR_PLURALS:
+        return head + IRREGULAR_PLURALS[last]
+    if last.endswith(("s", "x", "z", "ch", "sh")):
+        return word + "es"
+    if len(last) > 1 and last.endswith("y") and last[-2] not in "aeiou":
+        return word[:-1] + "ies"
+    return word + "s"
+
+
+def surface_variants(entity, forms=VARIANT_FORMS):
+    """Every surface form of entity: "bighorn sheep" also as bighorn_sheep / bighorn-sheep, plus plurals and
+    possessives ("lion's", "lions'") of each of them."""
+    singulars = {entity.lower()}
+    if "separator" in forms:
+        tokens = SEPARATORS.split(entity.lower())
+        singulars.update(separator.join(tokens) for separator in (" ", "_", "-"))
+    plurals = {plural(singular) for singular in singulars} if "plural" in forms else set()
+    variants = singulars | plurals
+    if "possessive" in forms:
+        variants.update(singular + "'s" for singular in singulars)
+        variants.update(word + ("'" if word.endswith("s") else "'s") for word in plurals)
+    return variants
+
+
+class EntityMatcher:
+    """Aho-Corasick automaton over every boundary variant of every word in the lexicon.
+
+    variants optionally maps extra surface forms to their word, hits on a surface form are reported as the word."""
+
+    def __init__(self, words, boundaries=BOUNDARIES, variants=None):
+        self.words = sorted(set(words))
+        self.variants = {word: word for word in self.words}
+        self.variants.update(variants or dict())
+        self.goto = [dict()]
+        self.fail = [0]
+        self.output = [[]]
+        for surface, word in sorted(self.variants.items()):
+            for prefix, suffix in boundaries:
+                self._add_pattern(f"{prefix}{surface}{suffix}", word)
+        self._build_failure_links()
+
+    def _add_pattern(self, pattern, word):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append(dict())
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        if (word, len(pattern)) not in self.output[state]:
+            self.output[state].append((word, len(pattern)))
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def finditer_spans(self, text):
+        """Yields (word, start, end) for every hit, including the boundary characters."""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                for word, length in output[state]:
+                    yield word, end - length, end
+
+    def finditer(self, text):
+        """Yields (word, offset) for every hit, offset being where find_word_in_text would point."""
+        for word, start, end in self.finditer_spans(text):
+            yield word, start
+
+    def find_all(self, text):
+        hits = dict()
+        for word, offset in self.finditer(text):
+            hits.setdefault(word, []).append(offset)
+        return hits
+
+
+@lru_cache(maxsize=4096)
+def _surface_probes(word, forms, boundaries):
+    return tuple(f"{prefix}{surface}{suffix}" for surface in sorted(surface_variants(word, forms))
+                 for prefix, suffix in boundaries)
+
+
+def find_first(word, text, forms=VARIANT_FORMS, boundaries=WORD_BOUNDARIES):
+    """Offset of the first hit of any surface variant of a single word, -1 if none. For one word, str.find over
+    the cached probes beats scanning the text with an automaton in Python."""
+    offsets = [text.find(probe) for probe in _surface_probes(word, tuple(forms), tuple(map(tuple, boundaries)))]
+    return min((offset for offset in offsets if offset >= 0), default=-1)
+
+
+@lru_cache(maxsize=4096)
+def _compile_lexicon(entities, forms, boundaries):
+    variants = {surface: entity for entity in entities for surface in surface_variants(entity, forms)}
+    return EntityMatcher(entities, boundaries=list(boundaries), variants=variants)
+
+
+def compile_lexicon(entities, forms=VARIANT_FORMS, boundaries=WORD_BOUNDARIES):
+    """One matcher over every surface variant of every entity, reporting hits as the canonical entity.
+    Compiled matchers are cached per (lexicon, forms, boundaries)."""
+    return _compile_lexicon(tuple(sorted(set(entities))), tuple(forms), tuple(map(tuple, boundaries)))
@@ -0,0 +1,259 @@
+import os
+import mmap
+import heapq
+import pickle
+import numpy as np
+from wiki_reader import iter_docs_in_shards, tokenize
+
+TERMS_FILE = "terms.bin"
+POSTINGS_FILE = "postings.bin"
+ARRAYS = ["term_offsets", "postings_offsets", "doc_freq", "term_freq", "doc_ids"]
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(buffer, pos):
+    value, shift = 0, 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_doc_postings(doc_delta, positions, out):
+    # Per doc: doc number delta, number of positions, then position deltas.
+    encode_varint(doc_delta, out)
+    encode_varint(len(positions), out)
+    last = 0
+    for position in positions:
+        encode_varint(position - last, out)
+        last = position
+
+
+def _flush_segment(postings, segment_path):
+    # Segment records store the first doc number absolutely, so segments can be concatenated by re-encoding
+    # only the first delta of each term.
+    with open(segment_path, "wb") as f:
+        for term in sorted(postings):
+            first_doc, last_doc, doc_freq, term_freq, encoded = postings[term]
+            pickle.dump((term, first_doc, last_doc, doc_freq, term_freq, bytes(encoded)), f)
+
+
+def _iter_segment(segment_path):
+    with open(segment_path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def _merge_segments(segment_paths, index_dir, doc_ids):
+    terms_blob = bytearray()
+    term_offsets, postings_offsets, doc_freqs, term_freqs = [0], [0], [], []
+    with open(os.path.join(index_dir, POSTINGS_FILE), "wb") as postings_file:
+        current_term, last_doc, doc_freq, term_freq = None, -1, 0, 0
+        postings_size = 0
+        for term, first_doc, segment_last_doc, segment_doc_freq, segment_term_freq, encoded in \
+                heapq.merge(*[_iter_segment(path) for path in segment_paths], key=lambda record: record[0]):
+            if term != current_term:
+                if current_term is not None:
+                    terms_blob += current_term.encode("utf-8")
+                    term_offsets.append(len(terms_blob))
+                    postings_offsets.append(postings_size)
+                    doc_freqs.append(doc_freq)
+                    term_freqs.append(term_freq)
+                current_term, last_doc, doc_freq, term_freq = term, -1, 0, 0
+            # Swap the absolute first doc of the segment for a delta from the previous segment.
+            _, pos = decode_varint(encoded, 0)
+            head = bytearray()
+            encode_varint(first_doc - last_doc, head)
+            postings_file.write(head)
+            postings_file.write(encoded[pos:])
+            postings_size += len(head) + len(encoded) - pos
+            last_doc = segment_last_doc
+            doc_freq += segment_doc_freq
+            term_freq += segment_term_freq
+
+        if current_term is not None:
+            terms_blob += current_term.encode("utf-8")
+            term_offsets.append(len(terms_blob))
+            postings_offsets.append(postings_size)
+            doc_freqs.append(doc_freq)
+            term_freqs.append(term_freq)
+
+    with open(os.path.join(index_dir, TERMS_FILE), "wb") as f:
+        f.write(terms_blob)
+    np.save(os.path.join(index_dir, "term_offsets.npy"), np.array(term_offsets, dtype=np.int64))
+    np.save(os.path.join(index_dir, "postings_offsets.npy"), np.array(postings_offsets, dtype=np.int64))
+    np.save(os.path.join(index_dir, "doc_freq.npy"), np.array(doc_freqs, dtype=np.uint32))
+    np.save(os.path.join(index_dir, "term_freq.npy"), np.array(term_freqs, dtype=np.uint64))
+    np.save(os.path.join(index_dir, "doc_ids.npy"), np.array(doc_ids, dtype=np.int64))
+
+
+def build_inverted_index(xml_paths, index_dir, max_segment_bytes=256 * 1024 * 1024, num_of_workers=None):
+    os.makedirs(index_dir, exist_ok=True)
+    postings = dict()
+    segment_paths = []
+    segment_bytes = 0
+    doc_ids = []
+
+    for shard_idx, xml_path, doc_id, title, text in iter_docs_in_shards(xml_paths, num_of_workers=num_of_workers):
+        doc_num = len(doc_ids)
+        doc_ids.append(int(doc_id) if doc_id.isdigit() else -1)
+        positions_by_term = dict()
+        for position, term in enumerate(tokenize(text)):
+            positions_by_term.setdefault(term, []).append(position)
+
+        for term, positions in positions_by_term.items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = [doc_num, doc_num, 0, 0, bytearray()]
+                postings[term] = entry
+            size = len(entry[4])
+            # The first doc of a term in a segment is stored as doc_num + 1 (a delta from -1).
+            encode_doc_postings(doc_num - entry[1] if size else doc_num + 1, positions, entry[4])
+            segment_bytes += len(entry[4]) - size
+            entry[1] = doc_num
+            entry[2] += 1
+            entry[3] += len(positions)
+
+        if segment_bytes >= max_segment_bytes:
+            segment_paths.append(os.path.join(index_dir, f"segment_{len(segment_paths)}.pkl"))
+            _flush_segment(postings, segment_paths[-1])
+            postings, segment_bytes = dict(), 0
+
+    if postings:
+        segment_paths.append(os.path.join(index_dir, f"segment_{len(segment_paths)}.pkl"))
+        _flush_segment(postings, segment_paths[-1])
+
+    print(f"Merge {len(segment_paths)} segments")
+    _merge_segments(segment_paths, index_dir, doc_ids)
+    for path in segment_paths:
+        os.remove(path)
+    print("Done")
+
+
+class InvertedIndex:
+    """Memory-mapped positional index written by build_inverted_index."""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r"))
+        self.terms = self._mmap(TERMS_FILE)
+        self.postings_buffer = self._mmap(POSTINGS_FILE)
+
+    def _mmap(self, file_name):
+        with open(os.path.join(self.index_dir, file_name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.doc_freq)
+
+    def _term(self, term_id):
+        return self.terms[self.term_offsets[term_id]: self.term_offsets[term_id + 1]]
+
+    def term_id(self, term):
+        key = term.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self._term(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(self) and self._term(low) == key:
+            return low
+        return -1
+
+    def __contains__(self, term):
+        return self.term_id(term) >= 0
+
+    def document_frequency(self, term):
+        term_id = self.term_id(term)
+        return int(self.doc_freq[term_id]) if term_id >= 0 else 0
+
+    def term_frequency(self, term):
+        term_id = self.term_id(term)
+        return int(self.term_freq[term_id]) if term_id >= 0 else 0
+
+    def postings(self, term):
+        """Yields (doc_num, positions) for a single term."""
+        term_id = self.term_id(term)
+        if term_id < 0:
+            return
+        buffer = self.postings_buffer
+        pos, end = int(self.postings_offsets[term_id]), int(self.postings_offsets[term_id + 1])
+        doc_num = -1
+        while pos < end:
+            doc_delta, pos = decode_varint(buffer, pos)
+            count, pos = decode_varint(buffer, pos)
+            doc_num += doc_delta
+            positions, position = [], 0
+            for _ in range(count):
+                delta, pos = decode_varint(buffer, pos)
+                position += delta
+                positions.append(position)
+            yield doc_num, positions
+
+    def phrase_postings(self, phrase):
+        """Yields (doc_num, start positions) of a multiword phrase, e.g. "bighorn sheep"."""
+        terms = tokenize(phrase)
+        if not terms:
+            return
+        if len(terms) == 1:
+            yield from self.postings(terms[0])
+            return
+        for doc_num, positions_list in self._intersect([self.postings(term) for term in terms]):
+            starts = set(positions_list[0])
+            for offset, positions in enumerate(positions_list[1:], 1):
+                starts &= {position - offset for position in positions}
+            if starts:
+                yield doc_num, sorted(starts)
+
+    @staticmethod
+    def _intersect(postings_iters):
+        heads = [next(postings, None) for postings in postings_iters]
+        while all(head is not None for head in heads):
+            max_doc = max(head[0] for head in heads)
+            if all(head[0] == max_doc for head in heads):
+                yield max_doc, [head[1] for head in heads]
+                heads = [next(postings, None) for postings in postings_iters]
+            else:
+                heads = [head if head[0] == max_doc else next(postings, None)
+                         for head, postings in zip(heads, postings_iters)]
+
+    def near(self, term_a, term_b, window):
+        """Returns {doc_num: count} of term_a occurrences with term_b within window tokens."""
+        span_a, span_b = len(tokenize(term_a)), len(tokenize(term_b))
+        counts = dict()
+        for doc_num, (positions_a, positions_b) in self._intersect([self.phrase_postings(term_a),
+                                                                      self.phrase_postings(term_b)]):
+            count, low = 0, 0
+            for position in positions_a:
+                while low < len(positions_b) and positions_b[low] + span_b - 1 < position - window:
+                    low += 1
+                if low < len(positions_b) and positions_b[low] <= position + span_a - 1 + window:
+                    count += 1
+            if count:
+                counts[doc_num] = count
+        return counts
+
+    def count_near(self, term_a, term_b, window):
+        return sum(self.near(term_a, term_b, window).values())
+
+
+if __name__ == "__main__":
+    from wikipedia_parser import find_wiki_shards
+    build_inverted_index(find_wiki_shards(), "wiki_index")
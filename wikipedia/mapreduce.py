@@ -0,0 +1,186 @@
+import os
+import time
+import pickle
+import shutil
+import multiprocessing
+from wiki_reader import iter_docs, shard_size
+from sorted_runs import partition_of, partition_path, iter_sorted_run, merge_runs
+from shard_manifest import shard_key
+
+_worker_state = dict()
+
+
+# Extensions open_shard reads, most preferred first when a shard exists in several forms.
+SHARD_EXTENSIONS = (".zst", ".bz2", ".gz", "")
+
+
+def discover_shards(root="."):
+    """WikiExtractor output files under root, in every dir holding wiki_00 (plain or compressed).
+    A shard kept both plain and compressed (wiki_00 and wiki_00.bz2) is listed once, compressed."""
+    shards = []
+    for dir, _, files in os.walk(root):
+        if not any(file.split(".")[0] == "wiki_00" for file in files):
+            continue
+        by_stem = dict()
+        for file in files:
+            stem = file.split(".")[0]
+            if file[len(stem):] in SHARD_EXTENSIONS:
+                by_stem.setdefault(stem, []).append(file)
+        for stem in sorted(by_stem):
+            file = min(by_stem[stem], key=lambda file: SHARD_EXTENSIONS.index(file[len(stem):]))
+            shards.append(os.path.join(dir, file))
+    return shards
+
+
+class MapReduceJob:
+    """A corpus statistic as hooks over str keys.
+
+    map(doc_id, title, text) yields (key, value) pairs for one document.
+    combine(key, values) folds one key's values of a shard into a single value, by default with reduce.
+    reduce(key, values) folds all values of a key, from every shard, into its final value.
+    """
+    num_partitions = 8
+    # Combined keys held in memory per shard before they are spilled to disk.
+    max_buffer_keys = 1000000
+
+    def map(self, doc_id, title, text):
+        raise NotImplementedError
+
+    def combine(self, key, values):
+        return self.reduce(key, values)
+
+    def reduce(self, key, values):
+        raise NotImplementedError
+
+
+def _spill(job, buffer, spill_path):
+    partitions = [[] for _ in range(job.num_partitions)]
+    for key in sorted(buffer):
+        partitions[partition_of(key, job.num_partitions)].append(key)
+    for partition, keys in enumerate(partitions):
+        with open(partition_path(spill_path, partition, job.num_partitions), "wb") as f:
+            for key in keys:
+                pickle.dump((key, buffer[key]), f)
+    buffer.clear()
+
+
+def _init_worker(job, spill_dir):
+    _worker_state["job"] = job
+    _worker_state["spill_dir"] = spill_dir
+
+
+def _map_task(args):
+    shard_num, xml_path, prefix, attempt = args
+    # Spills are named after the shard path and content (see ShardManifest.output_prefix), so a manifest can
+    # keep them across runs and the spills of a changed shard never reuse the names of its stale ones.
+    attempt_prefix = f"{prefix}_{attempt}"
+    job, spill_dir = _worker_state["job"], _worker_state["spill_dir"]
+    spill_paths = []
+    try:
+        buffer = dict()
+        num_of_records = 0
+        for doc_id, title, text in iter_docs(xml_path):
+            for key, value in job.map(doc_id, title, text):
+                num_of_records += 1
+                if key in buffer:
+                    buffer[key] = job.combine(key, [buffer[key], value])
+                else:
+                    buffer[key] = value
+            if len(buffer) >= job.max_buffer_keys:
+                spill_paths.append(os.path.join(spill_dir, f"{attempt_prefix}_{len(spill_paths)}.pkl"))
+                _spill(job, buffer, spill_paths[-1])
+        spill_paths.append(os.path.join(spill_dir, f"{attempt_prefix}_{len(spill_paths)}.pkl"))
+        _spill(job, buffer, spill_paths[-1])
+        return shard_num, xml_path, prefix, attempt, spill_paths, num_of_records, None
+    except Exception as e:
+        # A failed attempt leaves nothing behind, its shard is retried from scratch.
+        for spill_path in spill_paths:
+            for partition in range(job.num_partitions):
+                if os.path.isfile(partition_path(spill_path, partition, job.num_partitions)):
+                    os.remove(partition_path(spill_path, partition, job.num_partitions))
+        return shard_num, xml_path, prefix, attempt, [], 0, repr(e)
+
+
+def _reduce_task(args):
+    partition, spill_paths, output_path = args
+    job = _worker_state["job"]
+    # Spills are merged in levels of bounded fan-in, combine folds the intermediate levels.
+    return merge_runs([partition_path(path, partition, job.num_partitions) for path in spill_paths], output_path,
+                      job.combine, job.reduce)
+
+
+def run_job(job, xml_paths, output_path, num_of_workers=None, max_retries=2, spill_dir=None, keep_spills=False,
+            manifest=None):
+    """Runs job over xml_paths and writes each reduce partition as a key sorted pickle stream,
+    see load_job_output. Shards are handed to whichever worker is free next, failed shards are retried.
+
+    With a ShardManifest, shards it already holds are not mapped again: their spills are kept in spill_dir
+    and reduced together with the new ones."""
+    num_of_workers = num_of_workers or os.cpu_count()
+    spill_dir = spill_dir or output_path + ".spill"
+    os.makedirs(spill_dir, exist_ok=True)
+    total_bytes = sum(map(shard_size, xml_paths))
+    print(f"total shards: {len(xml_paths)} ({total_bytes / 2 ** 20:.1f} MB) workers: {num_of_workers} "
+          f"partitions: {job.num_partitions}")
+
+    start = time.time()
+    spill_paths, failed = [], []
+    num_of_shards, done_bytes, num_of_records = 0, 0, 0
+    with multiprocessing.Pool(processes=num_of_workers, initializer=_init_worker, initargs=(job, spill_dir)) as pool:
+        if manifest is not None:
+            # Stale outputs go before any worker writes, see ShardManifest.drop_stale.
+            manifest.drop_stale(xml_paths)
+        tasks = [(shard_num, xml_path, shard_key(xml_path) if manifest is None else manifest.output_prefix(xml_path), 0)
+                 for shard_num, xml_path in enumerate(xml_paths) if manifest is None or not manifest.is_done(xml_path)]
+        print(f"pending shards: {len(tasks)}")
+        while tasks:
+            retries = []
+            # chunksize=1 keeps every shard in the shared queue, so idle workers take the next one.
+            for shard_num, xml_path, prefix, attempt, paths, records, error in \
+                    pool.imap_unordered(_map_task, tasks, chunksize=1):
+                if error is not None:
+                    print(f"error in {xml_path} (attempt {attempt + 1}): {error}")
+                    if attempt < max_retries:
+                        retries.append((shard_num, xml_path, prefix, attempt + 1))
+                    else:
+                        failed.append(xml_path)
+                    continue
+                spill_paths += paths
+                if manifest is not None:
+                    for path in paths:
+                        manifest.mark_done(xml_path, path, num_partitions=job.num_partitions)
+                num_of_records += records
+                done_bytes += shard_size(xml_path)
+                if (num_of_shards % 25) == 0:
+                    if manifest is not None:
+                        manifest.save()
+                    elapsed = max(time.time() - start, 1e-9)
+                    print(f"Mapped {num_of_shards} / {len(xml_paths)} shards, {done_bytes / 2 ** 20:.1f} / "
+                          f"{total_bytes / 2 ** 20:.1f} MB, {done_bytes / elapsed / 2 ** 20:.1f} MB/s, "
+                          f"{num_of_records / elapsed:.0f} records/s")
+                num_of_shards += 1
+            tasks = retries
+        if manifest is not None:
+            manifest.save()
+            spill_paths = manifest.outputs()
+
+        jobs = [(partition, spill_paths, partition_path(output_path, partition, job.num_partitions))
+                for partition in range(job.num_partitions)]
+        num_of_keys = sum(pool.imap_unordered(_reduce_task, jobs))
+
+    if manifest is not None:
+        manifest.mark_merged()
+        manifest.save()
+    elif not keep_spills:
+        shutil.rmtree(spill_dir)
+    print(f"Done, {num_of_keys} keys in {time.time() - start:.1f}s, failed shards: {len(failed)}")
+    return failed
+
+
+def iter_job_output(output_path, num_partitions=MapReduceJob.num_partitions):
+    for partition in range(num_partitions):
+        yield from iter_sorted_run(partition_path(output_path, partition, num_partitions))
+
+
+def load_job_output(output_path, num_partitions=MapReduceJob.num_partitions):
+    return dict(iter_job_output(output_path, num_partitions))
@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import hashlib
+from collections import Counter
+import numpy as np
+from wiki_reader import iter_docs, tokenize
+
+SKETCH_FILE = "sketch.npy"
+TARGETS_FILE = "targets.json"
+META_FILE = "meta.json"
+# N-grams do not cross sentence or punctuation boundaries, apostrophes stay inside a phrase as in tokenize.
+PHRASE_BOUNDARIES = re.compile('[\!\?\"\.\,\;\:\(\)\[\]\n]')
+
+
+def ngram_key(phrase):
+    """Lexicon entries such as "bighorn sheep" or "mountain_goat" as the n-gram keys counted in the corpus."""
+    return " ".join(tokenize(phrase.replace("_", " ")))
+
+
+def iter_ngrams(tokens, max_n):
+    for n in range(1, max_n + 1):
+        for i in range(len(tokens) - n + 1):
+            yield " ".join(tokens[i: i + n])
+
+
+def iter_text_ngrams(text, max_n):
+    for phrase in PHRASE_BOUNDARIES.split(text):
+        yield from iter_ngrams(tokenize(phrase), max_n)
+
+
+class CountMinSketch:
+    """Approximate counts in a fixed depth x width table. Estimates never undercount and overcount by at most
+    e / width of the total count with probability 1 - exp(-depth). Sketches of the same shape merge by addition."""
+
+    def __init__(self, width=2 ** 22, depth=4, table=None):
+        self.table = table if table is not None else np.zeros((depth, width), dtype=np.uint32)
+        self.depth, self.width = self.table.shape
+
+    def _indices(self, keys):
+        digests = b"".join(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest() for key in keys)
+        hashes = np.frombuffer(digests, dtype="<u4").reshape((-1, 2)).astype(np.uint64)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        # Double hashing: row i uses h1 + i * h2.
+        return ((hashes[:, 0][None, :] + rows * hashes[:, 1][None, :]) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, counter):
+        keys = list(counter)
+        if not keys:
+            return
+        counts = np.fromiter((counter[key] for key in keys), dtype=np.uint32, count=len(keys))
+        indices = self._indices(keys)
+        for row in range(self.depth):
+            np.add.at(self.table[row], indices[row], counts)
+
+    def merge(self, other):
+        if self.table.shape != other.table.shape:
+            raise ValueError(f"Cannot merge sketches of shapes {self.table.shape} and {other.table.shape}")
+        self.table += other.table
+        return self
+
+    def estimate(self, keys):
+        indices = self._indices(keys)
+        return self.table[np.arange(self.depth)[:, None], indices].min(axis=0)
+
+    def __getitem__(self, key):
+        return int(self.estimate([key])[0])
+
+
+def count_ngrams(texts, max_n=4, targets=(), width=2 ** 22, depth=4, flush_size=1000000):
+    """Counts every n-gram (n <= max_n) of texts into a sketch, and the target n-grams exactly.
+    Exact counts are kept in a Counter that is flushed into the sketch once it holds flush_size n-grams."""
+    sketch = CountMinSketch(width, depth)
+    targets = set(targets)
+    target_counts = Counter({target: 0 for target in targets})
+    counter = Counter()
+    num_of_ngrams = 0
+
+    def flush():
+        for target in targets.intersection(counter):
+            target_counts[target] += counter[target]
+        sketch.add(counter)
+        counter.clear()
+
+    for text in texts:
+        ngrams = list(iter_text_ngrams(text, max_n))
+        num_of_ngrams += len(ngrams)
+        counter.update(ngrams)
+        if len(counter) >= flush_size:
+            flush()
+    flush()
+    return sketch, dict(target_counts), num_of_ngrams
+
+
+def count_ngrams_in_shards(xml_paths, max_n=4, targets=(), width=2 ** 22, depth=4, flush_size=1000000):
+    texts = (text for xml_path in xml_paths for doc_id, title, text in iter_docs(xml_path))
+    return count_ngrams(texts, max_n, targets, width, depth, flush_size)
+
+
+def merge_ngram_counts(merged, other):
+    sketch, target_counts, num_of_ngrams = merged
+    other_sketch, other_target_counts, other_num_of_ngrams = other
+    for target, count in other_target_counts.items():
+        target_counts[target] = target_counts.get(target, 0) + count
+    return sketch.merge(other_sketch), target_counts, num_of_ngrams + other_num_of_ngrams
+
+
+def save_ngram_counts(output_dir, sketch, target_counts, num_of_ngrams, max_n):
+    os.makedirs(output_dir, exist_ok=True)
+    np.save(os.path.join(output_dir, SKETCH_FILE), sketch.table)
+    with open(os.path.join(output_dir, TARGETS_FILE), "w") as f:
+        json.dump(target_counts, f)
+    with open(os.path.join(output_dir, META_FILE), "w") as f:
+        json.dump({"max_n": max_n, "num_of_ngrams": num_of_ngrams, "width": sketch.width, "depth": sketch.depth}, f)
+
+
+class NgramCounts:
+    """Exact counts for the target n-grams, count-min estimates for any other n-gram up to max_n."""
+
+    def __init__(self, output_dir):
+        self.sketch = CountMinSketch(table=np.load(os.path.join(output_dir, SKETCH_FILE), mmap_mode="r"))
+        with open(os.path.join(output_dir, TARGETS_FILE), "r") as f:
+            self.targets = json.load(f)
+        with open(os.path.join(output_dir, META_FILE), "r") as f:
+            self.meta = json.load(f)
+
+    def __getitem__(self, phrase):
+        key = ngram_key(phrase)
+        if key in self.targets:
+            return self.targets[key]
+        if not key or len(key.split(" ")) > self.meta["max_n"]:
+            return 0
+        return self.sketch[key]
+
+    def is_exact(self, phrase):
+        return ngram_key(phrase) in self.targets
+
+    def error_bound(self):
+        """With probability 1 - exp(-depth), estimates overcount by at most this much."""
+        return np.e / self.meta["width"] * self.meta["num_of_ngrams"]
@@ -0,0 +1,81 @@
+import os
+import multiprocessing
+import numpy as np
+
+
+def batched_least_squares(X, Y):
+    """Fits y = a + b * x independently on every row of the (B, n) arrays X and Y, returns (a, b) of shape (B,)."""
+    x_mean = X.mean(axis=1, keepdims=True)
+    y_mean = Y.mean(axis=1, keepdims=True)
+    dx = X - x_mean
+    with np.errstate(divide="ignore", invalid="ignore"):
+        b = (dx * (Y - y_mean)).sum(axis=1) / (dx * dx).sum(axis=1)
+    a = y_mean[:, 0] - b * x_mean[:, 0]
+    return a, b
+
+
+def _bootstrap_job(args):
+    x, y, num_resamples, seed = args
+    indices = np.random.default_rng(seed).integers(0, len(x), size=(num_resamples, len(x)))
+    return batched_least_squares(x[indices], y[indices])
+
+
+def _permutation_job(args):
+    x, y, num_resamples, seed = args
+    # An argsort of random keys permutes every row independently (Generator.permuted needs numpy >= 1.20).
+    permuted_y = y[np.argsort(np.random.default_rng(seed).random((num_resamples, len(y))), axis=1)]
+    return batched_least_squares(np.broadcast_to(x, permuted_y.shape), permuted_y)[1]
+
+
+def _run_batches(job, x, y, num_resamples, batch_size, seed, pool):
+    batches = [min(batch_size, num_resamples - start) for start in range(0, num_resamples, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    jobs = [(x, y, batch, batch_seed) for batch, batch_seed in zip(batches, seeds)]
+    return list(pool.map(job, jobs) if pool is not None else map(job, jobs))
+
+
+def resample_regression(x, y, num_resamples=10000, confidence=0.95, batch_size=2000, num_of_workers=None, seed=0):
+    """Least squares line of y on x with bootstrap confidence intervals and a two sided permutation p-value for the slope.
+
+    Resamples are drawn as (batch_size, n) index arrays and fitted in one vectorized step per batch,
+    batches are split across a process pool when there is more than one."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    intercept, slope = batched_least_squares(x[None, :], y[None, :])
+    pool = None
+    # Pool workers (e.g. the figure renderer's) are daemonic and cannot start a pool of their own.
+    if num_resamples > batch_size and num_of_workers != 1 and not multiprocessing.current_process().daemon:
+        pool = multiprocessing.Pool(processes=min(num_of_workers or os.cpu_count(), -(-num_resamples // batch_size)))
+    try:
+        bootstrap = _run_batches(_bootstrap_job, x, y, num_resamples, batch_size, seed, pool)
+        permuted_slopes = np.hstack(_run_batches(_permutation_job, x, y, num_resamples, batch_size, seed + 1, pool))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    intercepts = np.hstack([a for a, b in bootstrap])
+    slopes = np.hstack([b for a, b in bootstrap])
+    tail = 100 * (1 - confidence) / 2
+    return {
+        "intercept": float(intercept[0]),
+        "slope": float(slope[0]),
+        # Resamples with a constant x have no slope and are left out of the intervals.
+        "intercept_ci": tuple(np.nanpercentile(intercepts, [tail, 100 - tail])),
+        "slope_ci": tuple(np.nanpercentile(slopes, [tail, 100 - tail])),
+        "p_value": (1 + np.sum(np.abs(permuted_slopes) >= abs(slope[0]))) / (1 + num_resamples),
+        "intercepts": intercepts,
+        "slopes": slopes,
+    }
+
+
+def confidence_band(x_grid, intercepts, slopes, confidence=0.95):
+    """Pointwise bootstrap band of the fitted line over x_grid."""
+    lines = intercepts[:, None] + slopes[:, None] * np.asarray(x_grid, dtype=np.float64)[None, :]
+    tail = 100 * (1 - confidence) / 2
+    return np.nanpercentile(lines, tail, axis=0), np.nanpercentile(lines, 100 - tail, axis=0)
+
+
+def print_regression(name, result, confidence=0.95):
+    print(f"{name}: slope {result['slope']:.3g} {int(confidence * 100)}% CI [{result['slope_ci'][0]:.3g}, "
+          f"{result['slope_ci'][1]:.3g}] intercept {result['intercept']:.3g} {int(confidence * 100)}% CI "
+          f"[{result['intercept_ci'][0]:.3g}, {result['intercept_ci'][1]:.3g}] permutation p-value {result['p_value']:.3g}")
@@ -0,0 +1,143 @@
+import os
+import glob
+import json
+import hashlib
+from sorted_runs import partition_path
+
+# Bump when a pass changes what it writes for a shard, so finished shards are processed again.
+PROCESSING_VERSION = 1
+
+
+def file_hash(path, block_size=2 ** 20):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def lexicon_version(words):
+    return hashlib.md5("\n".join(sorted(words)).encode("utf-8")).hexdigest()[:12]
+
+
+class ShardManifest:
+    """Records, per task, which shards were processed with which content hash, version and lexicon."""
+
+    def __init__(self, path, task, processing_version=PROCESSING_VERSION):
+        self.path = path
+        self.task = task
+        self.processing_version = processing_version
+        self.data = dict()
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                self.data = json.load(f)
+        self.lexicons = self.data.setdefault("lexicons", dict())
+        self.task_data = self.data.setdefault(task, {"shards": dict(), "needs_rebuild": False})
+        self.shards = self.task_data["shards"]
+        self.hashes = dict()
+
+    def shard_hash(self, xml_path):
+        if xml_path not in self.hashes:
+            self.hashes[xml_path] = file_hash(xml_path)
+        return self.hashes[xml_path]
+
+    def _valid_entry(self, xml_path):
+        entry = self.shards.get(xml_path)
+        if entry is None or entry["hash"] != self.shard_hash(xml_path) or \
+                entry["processing_version"] != self.processing_version:
+            return None
+        return entry
+
+    def pending_words(self, xml_path, words):
+        entry = self._valid_entry(xml_path)
+        if entry is None:
+            return set(words)
+        done = set()
+        for version in entry["lexicons"]:
+            done.update(self.lexicons[version])
+        return set(words) - done
+
+    def is_done(self, xml_path):
+        return self._valid_entry(xml_path) is not None
+
+    def drop_stale(self, xml_paths):
+        """Drops the entries (and outputs) of shards whose content or processing version changed.
+        Call it before any worker writes, so new outputs are never deleted as stale ones."""
+        for xml_path in xml_paths:
+            if xml_path in self.shards and self._valid_entry(xml_path) is None:
+                self._drop_entry(xml_path)
+
+    def output_prefix(self, xml_path):
+        """Output name prefix of a shard, unique per shard content so old and new outputs never collide."""
+        return f"{shard_key(xml_path)}_{self.shard_hash(xml_path)[:12]}"
+
+    def shard_id(self, xml_path):
+        """Id of a shard that stays the same across runs, chunk records refer to their shard by it."""
+        shard_ids = self.task_data.setdefault("shard_ids", dict())
+        if xml_path not in shard_ids:
+            shard_ids[xml_path] = len(shard_ids)
+        return shard_ids[xml_path]
+
+    def mark_done(self, xml_path, output_path, words=None, num_partitions=1, corpus_path=None):
+        entry = self._valid_entry(xml_path)
+        if entry is None:
+            self._drop_entry(xml_path)
+            entry = {"hash": self.shard_hash(xml_path), "processing_version": self.processing_version,
+                     "lexicons": [], "outputs": []}
+            self.shards[xml_path] = entry
+        if words is not None:
+            version = lexicon_version(words)
+            self.lexicons[version] = sorted(words)
+            entry["lexicons"].append(version)
+        if corpus_path is not None:
+            entry["corpus"] = corpus_path
+        entry["outputs"].append({"path": output_path, "merged": False, "num_partitions": num_partitions})
+
+    def _drop_entry(self, xml_path):
+        entry = self.shards.pop(xml_path, None)
+        if entry is None:
+            return
+        for output in entry["outputs"]:
+            # Already merged into the artifact, which now has to be rebuilt without it.
+            self.task_data["needs_rebuild"] |= output["merged"]
+            for path in output_files(output):
+                if os.path.isfile(path):
+                    os.remove(path)
+        if os.path.isfile(entry.get("corpus", "")):
+            os.remove(entry["corpus"])
+
+    def outputs(self, merged=None):
+        return [output["path"] for entry in self.shards.values() for output in entry["outputs"]
+                if merged is None or output["merged"] == merged]
+
+    def corpus_paths(self):
+        return {self.shard_id(xml_path): entry["corpus"] for xml_path, entry in self.shards.items() if "corpus" in entry}
+
+    def needs_rebuild(self):
+        return self.task_data["needs_rebuild"]
+
+    def mark_merged(self):
+        for entry in self.shards.values():
+            for output in entry["outputs"]:
+                output["merged"] = True
+        self.task_data["needs_rebuild"] = False
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+
+def output_files(output):
+    """The files of an output entry: its partition files, exactly, never other outputs sharing the name prefix."""
+    if "num_partitions" in output:
+        return [partition_path(output["path"], partition, output["num_partitions"])
+                for partition in range(output["num_partitions"])]
+    # Entries written before num_partitions was recorded.
+    base, ext = os.path.splitext(output["path"])
+    return [output["path"]] + glob.glob(f"{glob.escape(base)}.*-of-*{glob.escape(ext)}")
+
+
+def shard_key(xml_path):
+    return hashlib.md5(xml_path.encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,113 @@
+import os
+import zlib
+import heapq
+import pickle
+import numpy as np
+import multiprocessing
+from itertools import groupby
+
+
+def partition_of(word, num_partitions):
+    return zlib.crc32(word.encode("utf-8")) % num_partitions
+
+
+def partition_path(path, partition, num_partitions):
+    if num_partitions == 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.{partition}-of-{num_partitions}{ext}"
+
+
+def write_sorted_runs(path, word_to_chunks, num_partitions=1):
+    """Writes (word, chunks) records in word order, split into num_partitions files by word hash."""
+    partitions = [[] for _ in range(num_partitions)]
+    for word in sorted(word_to_chunks):
+        if len(word_to_chunks[word]):
+            partitions[partition_of(word, num_partitions)].append(word)
+    for partition, words in enumerate(partitions):
+        with open(partition_path(path, partition, num_partitions), "wb") as f:
+            for word in words:
+                pickle.dump((word, word_to_chunks[word]), f)
+
+
+def iter_sorted_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+# Runs merged at once, every one of them holds an open file.
+MAX_FAN_IN = 256
+
+
+def _merge_runs(run_paths, output_path, reduce):
+    num_of_keys = 0
+    runs = [iter_sorted_run(path) for path in run_paths]
+    with open(output_path, "wb") as f:
+        for key, records in groupby(heapq.merge(*runs, key=lambda record: record[0]), key=lambda record: record[0]):
+            pickle.dump((key, reduce(key, [value for _, value in records])), f)
+            num_of_keys += 1
+    return num_of_keys
+
+
+def merge_runs(run_paths, output_path, combine, reduce=None, max_fan_in=MAX_FAN_IN):
+    """Merges sorted (key, value) runs into one, reducing the values of each key with reduce(key, values).
+    More than max_fan_in runs are first merged in levels of max_fan_in runs with combine, so at most
+    max_fan_in files are open at a time. Run order is kept, values of a key arrive in the order of their runs."""
+    reduce = reduce or combine
+    run_paths = [path for path in run_paths if os.path.isfile(path)]
+    level, intermediate = 0, []
+    while len(run_paths) > max_fan_in:
+        merged = []
+        for start in range(0, len(run_paths), max_fan_in):
+            merged.append(f"{output_path}.level{level}-{start // max_fan_in}.tmp")
+            _merge_runs(run_paths[start: start + max_fan_in], merged[-1], combine)
+        for path in intermediate:
+            os.remove(path)
+        run_paths = intermediate = merged
+        level += 1
+    tmp_path = output_path + ".tmp"
+    num_of_keys = _merge_runs(run_paths, tmp_path, reduce)
+    for path in intermediate:
+        os.remove(path)
+    # The output may also be one of the inputs when merging into an existing artifact.
+    os.replace(tmp_path, output_path)
+    return num_of_keys
+
+
+def concat_chunks(word, chunk_lists):
+    # Chunks are CHUNK_DTYPE record arrays, see chunk_store.
+    return np.concatenate(chunk_lists)
+
+
+def merge_sorted_runs(run_paths, output_path, max_fan_in=MAX_FAN_IN):
+    """Streams a k-way merge of sorted runs, holding one word's chunks in memory at a time."""
+    return merge_runs(run_paths, output_path, concat_chunks, max_fan_in=max_fan_in)
+
+
+def _merge_partition(args):
+    return merge_sorted_runs(*args)
+
+
+def combine_sorted_runs(run_paths, output_path, num_partitions=1, num_of_workers=None):
+    jobs = [([partition_path(path, partition, num_partitions) for path in run_paths],
+             partition_path(output_path, partition, num_partitions)) for partition in range(num_partitions)]
+    if num_partitions == 1:
+        return sum(map(_merge_partition, jobs))
+    with multiprocessing.Pool(processes=min(num_of_workers or os.cpu_count(), num_partitions)) as pool:
+        return sum(pool.map(_merge_partition, jobs))
+
+
+def load_word_chunks(path, words=None, num_partitions=1):
+    """Reads a combined artifact into {word: chunks}, only touching the partitions that hold the given words."""
+    words = None if words is None else set(words)
+    partitions = range(num_partitions) if words is None else {partition_of(word, num_partitions) for word in words}
+    word_to_chunks = dict()
+    for partition in sorted(partitions):
+        for word, chunks in iter_sorted_run(partition_path(path, partition, num_partitions)):
+            if words is None or word in words:
+                word_to_chunks[word] = chunks
+    return word_to_chunks
@@ -0,0 +1,74 @@
+import os
+import string
+import numpy as np
+
+# Entities the generator mixes into the text, a subset of the csv lexicon plus the property words.
+DEFAULT_ENTITIES = ["bird", "cat", "dog", "horse", "shark", "eagle", "whale", "bat", "owl", "duck", "fox", "bear",
+                    "snake", "wolf", "lion", "sea lion", "bighorn sheep", "fur", "hair", "wing", "fly", "horn", "fin",
+                    "beak", "feather", "scale", "underwater"]
+
+
+def synthetic_vocabulary(vocab_size, rng):
+    """vocab_size distinct lowercase pseudo words, short ones first so frequent words are short as in English."""
+    letters = np.array(list(string.ascii_lowercase))
+    words, seen = [], set()
+    length = 2
+    while len(words) < vocab_size:
+        for word in ("".join(chars) for chars in rng.choice(letters, size=(vocab_size, length))):
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+                if len(words) == vocab_size:
+                    break
+        length += 1
+    return words
+
+
+def _doc_text(rng, vocabulary, zipf_weights, entities, entity_rate, num_of_words, sentence_length):
+    words = np.array(vocabulary, dtype=object)[rng.choice(len(vocabulary), size=num_of_words, p=zipf_weights)]
+    entity_hits = np.nonzero(rng.random(num_of_words) < entity_rate)[0]
+    if len(entity_hits):
+        words[entity_hits] = np.array(entities, dtype=object)[rng.integers(0, len(entities), len(entity_hits))]
+        plural = entity_hits[rng.random(len(entity_hits)) < 0.3]
+        words[plural] = words[plural] + "s"
+    sentence_ends = np.arange(sentence_length - 1, num_of_words, sentence_length)
+    words[sentence_ends] = words[sentence_ends] + "."
+    commas = np.nonzero(rng.random(num_of_words) < 0.05)[0]
+    words[commas] = words[commas] + ","
+    sentences = " ".join(words).split(". ")
+    return ".\n".join(sentence[:1].upper() + sentence[1:] for sentence in sentences)
+
+
+def generate_corpus(output_dir, num_shards=4, shard_bytes=2 ** 20, vocab_size=50000, zipf_exponent=1.1,
+                    entities=DEFAULT_ENTITIES, entity_rate=0.002, doc_words=(50, 2000), sentence_length=20, seed=0):
+    """Writes WikiExtractor-format shards output_dir/AA/wiki_00, wiki_01, ... of about shard_bytes each.
+
+    Words follow a Zipf(zipf_exponent) law over a synthetic vocabulary, and each word is replaced by an entity
+    with probability entity_rate (30% of them pluralized). Returns the shard paths."""
+    rng = np.random.default_rng(seed)
+    vocabulary = synthetic_vocabulary(vocab_size, rng)
+    zipf_weights = 1. / np.arange(1, vocab_size + 1) ** zipf_exponent
+    zipf_weights /= zipf_weights.sum()
+
+    shard_dir = os.path.join(output_dir, "AA")
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_paths = []
+    doc_id = 0
+    for shard_num in range(num_shards):
+        shard_path = os.path.join(shard_dir, f"wiki_{shard_num:02d}")
+        written = 0
+        with open(shard_path, "w") as f:
+            while written < shard_bytes:
+                doc_id += 1
+                title = f"Article {doc_id}"
+                text = _doc_text(rng, vocabulary, zipf_weights, entities, entity_rate,
+                                 int(rng.integers(doc_words[0], doc_words[1] + 1)), sentence_length)
+                doc = f'<doc id="{doc_id}" url="?curid={doc_id}" title="{title}">\n{title}\n\n{text}\n</doc>\n'
+                f.write(doc)
+                written += len(doc.encode("utf-8"))
+        shard_paths.append(shard_path)
+    return shard_paths
+
+
+if __name__ == "__main__":
+    print(generate_corpus("synthetic_text"))
@@ -0,0 +1,167 @@
+import os
+import hashlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+from entity_matcher import compile_lexicon
+from wiki_reader import iter_docs, shard_progress, shard_size
+
+_worker_state = dict()
+
+
+def doc_hashes(doc_keys):
+    digests = b"".join(hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest() for key in doc_keys)
+    return np.frombuffer(digests, dtype="<u8")
+
+
+def hll_estimate(registers):
+    """HyperLogLog cardinality estimates for a (..., m) register array, with the small range correction."""
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)), axis=-1)
+    zeros = np.sum(registers == 0, axis=-1)
+    with np.errstate(divide="ignore"):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+class TermSketches:
+    """Per term exact occurrence counts and a HyperLogLog sketch of the documents the term occurs in.
+    Sketches over the same terms merge by register-wise max, so shards can be counted independently."""
+
+    def __init__(self, terms, precision=12, registers=None, counts=None, num_docs=0):
+        self.terms = list(terms)
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+        self.precision = precision
+        self.registers = registers if registers is not None else \
+            np.zeros((len(self.terms), 2 ** precision), dtype=np.uint8)
+        self.counts = counts if counts is not None else np.zeros(len(self.terms), dtype=np.int64)
+        self.num_docs = num_docs
+
+    def add(self, term_ids, hashes):
+        """Records that the documents with the given 64 bit hashes contain term_ids (two aligned arrays)."""
+        bucket = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        # Rank of the first set bit in the low 32 bits, which never overlap the bucket bits.
+        low = (hashes & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        rank = np.where(low > 0, 33 - np.frexp(low)[1], 33).astype(np.uint8)
+        np.maximum.at(self.registers, (np.asarray(term_ids, dtype=np.int64), bucket), rank)
+
+    def merge(self, other):
+        if self.terms != other.terms or self.precision != other.precision:
+            raise ValueError("Only sketches over the same terms and precision can be merged")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        self.counts += other.counts
+        self.num_docs += other.num_docs
+        return self
+
+    def ids(self, terms):
+        return np.array([self.term_index[term] for term in terms], dtype=np.int64)
+
+    def document_frequency(self, terms=None):
+        return hll_estimate(self.registers if terms is None else self.registers[self.ids(terms)])
+
+    def pair_document_frequency(self, terms_a, terms_b, block_size=256):
+        """Estimated number of documents containing both terms, for every (a, b) pair, by inclusion-exclusion."""
+        ids_a, ids_b = self.ids(terms_a), self.ids(terms_b)
+        df_a, df_b = hll_estimate(self.registers[ids_a]), hll_estimate(self.registers[ids_b])
+        union = np.zeros((len(ids_a), len(ids_b)))
+        for start in range(0, len(ids_a), block_size):
+            block = self.registers[ids_a[start: start + block_size]]
+            union[start: start + block_size] = hll_estimate(np.maximum(block[:, None, :],
+                                                                       self.registers[ids_b][None, :, :]))
+        # Intersections of rare terms are below the sketch's error, they are clipped rather than going negative.
+        return np.clip(df_a[:, None] + df_b[None, :] - union, 0, np.minimum(df_a[:, None], df_b[None, :]))
+
+    def save(self, path):
+        np.savez(path, terms=np.array(self.terms), precision=self.precision, registers=self.registers,
+                 counts=self.counts, num_docs=self.num_docs)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls([str(term) for term in f["terms"]], int(f["precision"]), f["registers"], f["counts"],
+                       int(f["num_docs"]))
+
+
+def pmi_table(joint, count_a, count_b, total):
+    """PMI and NPMI of every (a, b) pair from joint counts and marginal counts out of total, nan where joint is 0."""
+    joint = np.asarray(joint, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_joint = joint / total
+        pmi = np.log(p_joint / (np.asarray(count_a, dtype=np.float64)[:, None] / total) /
+                     (np.asarray(count_b, dtype=np.float64)[None, :] / total))
+        npmi = pmi / -np.log(p_joint)
+    pmi[joint <= 0] = np.nan
+    npmi[joint <= 0] = np.nan
+    return pmi, npmi
+
+
+def pair_statistics(sketches, entities, properties):
+    """Document frequency, PMI and NPMI of every (entity, property) pair, one row per pair."""
+    df_entity = sketches.document_frequency(entities)
+    df_property = sketches.document_frequency(properties)
+    df_pair = sketches.pair_document_frequency(entities, properties)
+    pmi, npmi = pmi_table(df_pair, df_entity, df_property, max(sketches.num_docs, 1))
+    return pd.DataFrame({
+        "entity": np.repeat(entities, len(properties)),
+        "property": np.tile(properties, len(entities)),
+        "entity_count": np.repeat(sketches.counts[sketches.ids(entities)], len(properties)),
+        "property_count": np.tile(sketches.counts[sketches.ids(properties)], len(entities)),
+        "entity_df": np.repeat(df_entity, len(properties)),
+        "property_df": np.tile(df_property, len(entities)),
+        "pair_df": df_pair.ravel(),
+        "pmi": pmi.ravel(),
+        "npmi": npmi.ravel(),
+    })
+
+
+def _init_worker(terms, precision):
+    _worker_state["terms"] = terms
+    _worker_state["precision"] = precision
+    _worker_state["matcher"] = compile_lexicon(terms)
+
+
+def count_shard_terms(xml_path):
+    state = _worker_state
+    sketches = TermSketches(state["terms"], state["precision"])
+    term_ids, doc_keys = [], []
+    for doc_id, title, text in iter_docs(xml_path):
+        hits = state["matcher"].find_all(text.lower())
+        for term, offsets in hits.items():
+            term_id = sketches.term_index[term]
+            sketches.counts[term_id] += len(offsets)
+            term_ids.append(term_id)
+            doc_keys.append(doc_id)
+        sketches.num_docs += 1
+    if term_ids:
+        sketches.add(term_ids, doc_hashes(doc_keys))
+    return sketches
+
+
+def _count_shard_job(xml_path):
+    return xml_path, count_shard_terms(xml_path)
+
+
+def build_term_sketches(xml_paths, terms, precision=12, num_of_workers=None, output_path="wiki_term_sketches.npz"):
+    terms = sorted(set(terms))
+    num_of_workers = num_of_workers or os.cpu_count()
+    print(f"total shards: {len(xml_paths)} terms: {len(terms)} registers per term: {2 ** precision}")
+
+    merged = TermSketches(terms, precision)
+    progress = shard_progress(xml_paths)
+    with multiprocessing.Pool(processes=num_of_workers, initializer=_init_worker, initargs=(terms, precision)) as pool:
+        for xml_path, sketches in pool.imap_unordered(_count_shard_job, xml_paths):
+            merged.merge(sketches)
+            progress.update(shard_size(xml_path))
+
+    merged.save(output_path)
+    print(f"Done, {merged.num_docs} documents")
+    return merged
+
+
+if __name__ == "__main__":
+    from wikipedia_parser import find_wiki_shards, collect_all_entities
+    from wikipedia_graph_plotter import COOCCURRENCE_PROPERTIES
+    entities = sorted(collect_all_entities())
+    sketches = build_term_sketches(find_wiki_shards(), entities + COOCCURRENCE_PROPERTIES)
+    pair_statistics(sketches, entities, COOCCURRENCE_PROPERTIES).to_csv("../csv/wiki_pair_statistics.csv")
@@ -0,0 +1,80 @@
+import os
+import mmap
+import pickle
+import numpy as np
+
+VOCAB_FILE = "vocab.bin"
+OFFSETS_FILE = "offsets.npy"
+COUNTS_FILE = "counts.npy"
+BY_COUNT_FILE = "by_count.npy"
+
+
+def write_unigram_table(counter, table_dir):
+    """Writes a word -> count mapping as a sorted utf-8 vocab blob, an offsets array and a uint64 counts array."""
+    os.makedirs(table_dir, exist_ok=True)
+    encoded = sorted((word.encode("utf-8"), count) for word, count in counter.items())
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(word) for word, count in encoded])
+    counts = np.array([count for word, count in encoded], dtype=np.uint64)
+    with open(os.path.join(table_dir, VOCAB_FILE), "wb") as f:
+        for word, count in encoded:
+            f.write(word)
+    np.save(os.path.join(table_dir, OFFSETS_FILE), offsets)
+    np.save(os.path.join(table_dir, COUNTS_FILE), counts)
+    np.save(os.path.join(table_dir, BY_COUNT_FILE), np.argsort(-counts.astype(np.int64), kind="stable"))
+
+
+def convert_unigram_pickle(pkl_path, table_dir):
+    with open(pkl_path, "rb") as f:
+        write_unigram_table(pickle.load(f), table_dir)
+
+
+class UnigramTable:
+    """Memory-mapped, read-only stand-in for the pickled wiki unigram Counter."""
+
+    def __init__(self, table_dir):
+        self.table_dir = table_dir
+        self.offsets = np.load(os.path.join(table_dir, OFFSETS_FILE), mmap_mode="r")
+        self.counts = np.load(os.path.join(table_dir, COUNTS_FILE), mmap_mode="r")
+        self.by_count = np.load(os.path.join(table_dir, BY_COUNT_FILE), mmap_mode="r")
+        with open(os.path.join(table_dir, VOCAB_FILE), "rb") as f:
+            self.vocab = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if len(self.counts) else b""
+
+    def __len__(self):
+        return len(self.counts)
+
+    def word(self, index):
+        return self.vocab[self.offsets[index]: self.offsets[index + 1]].decode("utf-8")
+
+    def index(self, word):
+        key = word.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self.vocab[self.offsets[mid]: self.offsets[mid + 1]] < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(self) and self.vocab[self.offsets[low]: self.offsets[low + 1]] == key:
+            return low
+        return -1
+
+    def __contains__(self, word):
+        return self.index(word) >= 0
+
+    def __getitem__(self, word):
+        index = self.index(word)
+        return int(self.counts[index]) if index >= 0 else 0
+
+    def counts_for(self, words):
+        indices = np.array([self.index(word) for word in words], dtype=np.int64)
+        counts = np.zeros(len(indices), dtype=np.uint64)
+        counts[indices >= 0] = self.counts[indices[indices >= 0]]
+        return counts
+
+    def top_k(self, k):
+        return [(self.word(index), int(self.counts[index])) for index in self.by_count[:k]]
+
+
+if __name__ == "__main__":
+    convert_unigram_pickle("wiki_unigram_dont_delete.pkl", "wiki_unigram_table")
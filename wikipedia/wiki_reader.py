@@ -0,0 +1,134 @@
+import io
+import os
+import re
+import bz2
+import gzip
+import time
+import multiprocessing
+from xml.sax.saxutils import unescape
+
+DOC_START = re.compile(r'^<doc id="(?P<id>[^"]*)"[^>]*?title="(?P<title>[^"]*)"[^>]*>')
+DOC_END = "</doc>"
+XML_ENTITIES = {"&quot;": '"', "&apos;": "'"}
+TOKEN_SEPARATORS = re.compile('[\'\!\?\"\.\,\;\:\(\)\[\]\n]')
+
+
+def tokenize(text):
+    return [word.lower() for word in TOKEN_SEPARATORS.sub(' ', text).split(" ") if word]
+
+
+def iter_docs_from_lines(lines, source=""):
+    doc_id, title, text_lines = None, None, None
+    for line_num, line in enumerate(lines):
+        if line.startswith("<doc "):
+            if text_lines is not None:
+                print(f"{source}:{line_num} doc {doc_id} has no closing tag, skipped")
+            header = DOC_START.match(line)
+            if header is None:
+                print(f"{source}:{line_num} malformed doc header, skipped")
+                doc_id, title, text_lines = None, None, None
+                continue
+            doc_id, title = header.group("id"), unescape(header.group("title"), XML_ENTITIES)
+            text_lines = [line[header.end():]]
+        elif line.startswith(DOC_END) and text_lines is not None:
+            yield doc_id, title, unescape("".join(text_lines), XML_ENTITIES)
+            doc_id, title, text_lines = None, None, None
+        elif text_lines is not None:
+            text_lines.append(line)
+
+    if text_lines is not None:
+        print(f"{source} ended inside doc {doc_id}, skipped")
+
+
+def open_shard(xml_path):
+    """Opens a plain, .bz2, .gz or .zst WikiExtractor shard as text."""
+    if xml_path.endswith(".bz2"):
+        return bz2.open(xml_path, "rt", encoding="utf-8")
+    if xml_path.endswith(".gz"):
+        return gzip.open(xml_path, "rt", encoding="utf-8")
+    if xml_path.endswith(".zst"):
+        import zstandard
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(xml_path, "rb"), closefd=True),
+                                encoding="utf-8")
+    return open(xml_path, "r")
+
+
+def iter_docs(xml_path):
+    """Streams (doc_id, title, text) out of a WikiExtractor shard, one article at a time."""
+    with open_shard(xml_path) as f:
+        yield from iter_docs_from_lines(f, source=xml_path)
+
+
+def shard_size(xml_path):
+    return os.path.getsize(xml_path) if os.path.isfile(xml_path) else 0
+
+
+class Progress:
+    """Prints items done, MB done and MB/s of a corpus pass every `every` items."""
+
+    def __init__(self, total_items, total_bytes, unit="shards", every=25):
+        self.total_items, self.total_bytes = total_items, total_bytes
+        self.unit, self.every = unit, every
+        self.items, self.bytes = 0, 0
+        self.start = time.time()
+
+    def update(self, num_bytes, num_items=1):
+        self.items += num_items
+        self.bytes += num_bytes
+        if (self.items % self.every) == 0 or self.items == self.total_items:
+            elapsed = max(time.time() - self.start, 1e-9)
+            print(f"Processed {self.items} / {self.total_items} {self.unit}, {self.bytes / 2 ** 20:.1f} / "
+                  f"{self.total_bytes / 2 ** 20:.1f} MB, {self.bytes / elapsed / 2 ** 20:.1f} MB/s")
+
+
+def shard_progress(xml_paths, every=25):
+    return Progress(len(xml_paths), sum(map(shard_size, xml_paths)), every=every)
+
+
+def _stream_shards(xml_paths, queue, batch_bytes):
+    # Docs go out in batches of about batch_bytes of text, the bounded queue blocks the worker when it is ahead.
+    for xml_path in xml_paths:
+        try:
+            batch, size = [], 0
+            for doc in iter_docs(xml_path):
+                batch.append(doc)
+                size += len(doc[2])
+                if size >= batch_bytes:
+                    queue.put((xml_path, batch, None))
+                    batch, size = [], 0
+            queue.put((xml_path, batch, None))
+            queue.put((xml_path, None, None))
+        except Exception as e:
+            queue.put((xml_path, None, repr(e)))
+            return
+
+
+def iter_docs_in_shards(xml_paths, num_of_workers=None, prefetch=4, batch_bytes=2 ** 22):
+    """Yields (shard_idx, xml_path, doc_id, title, text) for every doc, in shard order, parsed in worker
+    processes meanwhile. Shard i is read by worker i % num_of_workers and every worker keeps at most prefetch
+    doc batches in flight, so memory is bounded by num_of_workers * prefetch * batch_bytes whatever the shard sizes."""
+    xml_paths = list(xml_paths)
+    num_of_workers = max(1, min(num_of_workers or os.cpu_count(), len(xml_paths)))
+    queues = [multiprocessing.Queue(maxsize=prefetch) for _ in range(num_of_workers)]
+    workers = [multiprocessing.Process(target=_stream_shards, daemon=True,
+                                       args=(xml_paths[i::num_of_workers], queues[i], batch_bytes))
+               for i in range(num_of_workers)]
+    for worker in workers:
+        worker.start()
+    progress = shard_progress(xml_paths)
+    try:
+        for shard_idx, xml_path in enumerate(xml_paths):
+            queue = queues[shard_idx % num_of_workers]
+            while True:
+                path, batch, error = queue.get()
+                if error is not None:
+                    raise RuntimeError(f"error in {path}: {error}")
+                if batch is None:
+                    break
+                for doc_id, title, text in batch:
+                    yield shard_idx, xml_path, doc_id, title, text
+            progress.update(shard_size(xml_path))
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
@@ -3,44 +3,73 @@ import xml.etree.ElementTree as ET
 from collections import Counter
 import os
 import threading
+from functools import lru_cache
 import numpy as np
 import pickle
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.stats import chisquare
+from cooccurrence import load_cooccurrence_matrix
+from unigram_table import UnigramTable
+from cooccurrence_classifier import CooccurrenceThresholdClassifier, roc_curve, auc, log_binned_curve
+from resampling import resample_regression, confidence_band, print_regression
+# Like scripts/, run with the repository root on PYTHONPATH for the results store.
+from scripts.results_store import RESULTS_STORE, load_results_by_animal
 
-def find_word_in_text(word, text):
-    indices = set()
-    indices.add(text.find(f" {word} "))
-    indices.add(text.find(f" {word}."))
-    indices.add(text.find(f" {word}s"))
-    indices.add(text.find(f" {word}:"))
-    indices.add(text.find(f'"{word}"'))
-    indices.add(text.find(f' {word}?'))
-    indices.add(text.find(f' {word}-'))
-    indices.add(text.find(f' {word},'))
-    indices.add(text.find(f' {word};'))
-    indices.remove(-1)
-    if len(indices) == 0:
-        return -1
+RESULTS_DIR = "../csv/results"
+# (No test set, Yes test set) per property, in the order of the property lists below.
+RESULT_PAIRS = [
+    ("animals_cant_fly_questions", "animals_can_fly_questions"),
+    ("animals_dont_have_a_beak_questions", "animals_have_a_beak_questions"),
+    ("animals_dont_have_feathers_questions", "animals_have_feathers_questions"),
+    ("animals_dont_have_fins_questions", "animals_have_fins_questions"),
+    ("animals_dont_have_fur_questions", "animals_have_fur_questions"),
+    ("animals_dont_have_hair_questions", "animals_have_hair_questions"),
+    ("animals_dont_have_horns_questions", "animals_have_horns_questions"),
+    # ("animals_dont_have_scales_questions", "animals_have_scales_questions"),
+    ("animals_dont_have_wings_questions", "animals_have_wings_questions"),
+    ("animals_dont_live_underwater_questions", "animals_live_underwater_questions"),
+]
+BY_ANIMAL_COLUMNS = ["animal", "accuracy", "yes_count", "no_count"]
+
+COOCCURRENCE_PROPERTIES = [
+    "fly",
+    "beak",
+    "feather",
+    "fin",
+    "fur",
+    "hair",
+    "horn",
+    "wing",
+    "underwater",
+]
+
+
+def show_or_save(output_path=""):
+    if output_path:
+        plt.savefig(output_path)
     else:
-        return min(indices)
+        plt.show()
+    plt.close()
 
 
-def plot_occurrence_by_property(exact=False):
-    df_pairs = [
-        ("../csv/results/animals_cant_fly_questions_result_by_animal.csv", "../csv/results/animals_can_fly_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_a_beak_questions_result_by_animal.csv", "../csv/results/animals_have_a_beak_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_feathers_questions_result_by_animal.csv", "../csv/results/animals_have_feathers_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_fins_questions_result_by_animal.csv", "../csv/results/animals_have_fins_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_fur_questions_result_by_animal.csv", "../csv/results/animals_have_fur_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_hair_questions_result_by_animal.csv", "../csv/results/animals_have_hair_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_horns_questions_result_by_animal.csv", "../csv/results/animals_have_horns_questions_result_by_animal.csv"),
-        # ("../csv/results/animals_dont_have_scales_questions_result_by_animal.csv", "../csv/results/animals_have_scales_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_wings_questions_result_by_animal.csv", "../csv/results/animals_have_wings_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_live_underwater_questions_result_by_animal.csv", "../csv/results/animals_live_underwater_questions_result_by_animal.csv"),
-    ]
+@lru_cache(maxsize=None)
+def load_result_pair(pair, checkpoint=None, store_dir=RESULTS_STORE, results_dir=RESULTS_DIR):
+    """Per-animal results of both test sets of a pair, read from the results store,
+    or from the *_result_by_animal.csv summaries for test sets that are not in it.
+    checkpoint is required once the store holds results of more than one checkpoint."""
+    dfs = []
+    for test_set in pair:
+        df = load_results_by_animal(test_set, checkpoint=checkpoint, store_dir=store_dir)
+        if len(df) == 0:
+            df = pd.read_csv(os.path.join(results_dir, f"{test_set}_result_by_animal.csv"), usecols=BY_ANIMAL_COLUMNS)
+        dfs.append(df)
+    return tuple(dfs)
+
+
+def plot_occurrence_by_property(exact=False, unigram_table_dir="wiki_unigram_table", output_path="", num_resamples=10000,
+                                checkpoint=None):
     title = [
         "Can animal fly?",
         "Does a animal have a beak?",
@@ -67,13 +96,11 @@ def plot_occurrence_by_property(exact=False):
         "underwater",
     ]
 
-    with open("wiki_unigram_dont_delete.pkl", "rb") as f:
-        wiki_unigram = pickle.load(f)
+    wiki_unigram = UnigramTable(unigram_table_dir)
 
     data = []
-    for idx, df_pair in enumerate(df_pairs):
-        animal_group_A = pd.read_csv(df_pair[0])
-        animal_group_B = pd.read_csv(df_pair[1])
+    for idx, pair in enumerate(RESULT_PAIRS):
+        animal_group_A, animal_group_B = load_result_pair(pair, checkpoint)
         if exact:
             total_animals = len(animal_group_A[animal_group_A["accuracy"].values == 1]) + \
                             len(animal_group_B[animal_group_B["accuracy"].values == 1]) + \
@@ -95,11 +122,12 @@ def plot_occurrence_by_property(exact=False):
     plt.figure(figsize=(15, 5))
     X = np.array([x[0] for x in data])
     Y = np.array([x[1] for x in data])
-    A = np.hstack([np.ones((len(X), 1)), X.reshape((-1, 1))])
-    b = Y.reshape((-1, 1))
-    res = np.linalg.lstsq(a=A, b=b)
-    a, b = res[0][0], res[0][1]
+    regression = resample_regression(X, Y, num_resamples=num_resamples)
+    print_regression("accuracy ~ property count", regression)
+    a, b = regression["intercept"], regression["slope"]
     plt.plot(X, X*b + a, "--", color="red", label="linear regression")
+    plt.fill_between(X, *confidence_band(X, regression["intercepts"], regression["slopes"]), color="red", alpha=0.1,
+                     label="95% bootstrap CI")
     labels = [x[2] for x in data]
     plt.scatter(X, Y)
     for i in range(len(X)):
@@ -119,85 +147,40 @@ def plot_occurrence_by_property(exact=False):
     plt.xticks(x_ticks, x_ticks_labels)
     plt.grid(True)
     plt.legend()
-    plt.show()
-    plt.close()
-
+    show_or_save(output_path)
 
 
-def plot_cooccurrence():
-    df_pairs = [
-        ("../csv/results/animals_cant_fly_questions_result_by_animal.csv", "../csv/results/animals_can_fly_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_a_beak_questions_result_by_animal.csv", "../csv/results/animals_have_a_beak_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_feathers_questions_result_by_animal.csv", "../csv/results/animals_have_feathers_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_fins_questions_result_by_animal.csv", "../csv/results/animals_have_fins_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_fur_questions_result_by_animal.csv", "../csv/results/animals_have_fur_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_hair_questions_result_by_animal.csv", "../csv/results/animals_have_hair_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_horns_questions_result_by_animal.csv", "../csv/results/animals_have_horns_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_wings_questions_result_by_animal.csv", "../csv/results/animals_have_wings_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_live_underwater_questions_result_by_animal.csv", "../csv/results/animals_live_underwater_questions_result_by_animal.csv"),
-
-    ]
-
-    property = [
-        "fly",
-        "beak",
-        "feather",
-        "fin",
-        "fur",
-        "hair",
-        "horn",
-        "wing",
-        "underwater",
-    ]
 
-    with open("wiki_word_to_sentences.pkl", "rb") as f:
-        wiki_text_chunks_by_animal = pickle.load(f)
+def plot_cooccurrence(cooccurrence_path="wiki_cooccurrence.npz", output_path="", num_resamples=10000, window=None,
+                      checkpoint=None):
+    property = COOCCURRENCE_PROPERTIES
+    co_occurrence = load_cooccurrence_matrix(cooccurrence_path, window=window)
 
     all_yes_count_percentage = []
     all_co_occurrence_count = []
     all_animals = []
-    for idx, df_pair in enumerate(df_pairs):
-        co_occurrence_count, yes_count_percentage, animals = co_occurrence_helper(df_pair, wiki_text_chunks_by_animal, property[idx])
+    for idx, pair in enumerate(RESULT_PAIRS):
+        co_occurrence_count, yes_count_percentage, animals = co_occurrence_helper(pair, co_occurrence, property[idx], checkpoint)
         all_yes_count_percentage.append(yes_count_percentage)
         all_co_occurrence_count.append(co_occurrence_count)
         all_animals.append(animals)
 
     all_co_occurrence_count = np.hstack(all_co_occurrence_count)
     all_yes_count_percentage = np.hstack(all_yes_count_percentage)
-    data = list(zip(all_co_occurrence_count, all_yes_count_percentage))
-    data = sorted(data, key=lambda x: x[0])
-    all_co_occurrence_count = np.array([x[0] for x in data])
-    all_yes_count_percentage = np.array([x[1] for x in data])
-    thresholds = np.unique(all_co_occurrence_count)
-    best_threshold = 0
-    best_accuracy = 0
-    for th in thresholds:
-        predictions = (all_co_occurrence_count > th).astype(np.int)
-        accuracy = (predictions == all_yes_count_percentage).sum() / len(all_yes_count_percentage)
-        if accuracy > best_accuracy:
-            best_accuracy = accuracy
-            best_threshold = th
-            print(f"Found better threshold {best_threshold} accuracy {best_accuracy}")
-            print("-" * 20)
+    classifier = CooccurrenceThresholdClassifier().fit(all_co_occurrence_count, all_yes_count_percentage)
+    best_threshold, best_accuracy = classifier.threshold, classifier.accuracy
+    fpr, tpr, _ = roc_curve(all_co_occurrence_count, all_yes_count_percentage)
     print(f"Best Yes/No Classifier {best_threshold} with accuracy {best_accuracy}")
+    print(f"ROC AUC {auc(fpr, tpr)}")
     print(f"Yes count {(all_yes_count_percentage==1).sum()}")
     print(f"No count {(all_yes_count_percentage==0).sum()}")
+    print_regression("yes rate ~ log2(1 + co-occurrence)", resample_regression(
+        np.log2(1 + all_co_occurrence_count), all_yes_count_percentage, num_resamples=num_resamples))
     data = {"co_occurrence": all_co_occurrence_count, "Model Answer": all_yes_count_percentage}
     data = pd.DataFrame.from_dict(data)
     data["co_occurrence"][data["Model Answer"] == 1] = "Yes"
     data["co_occurrence"][data["Model Answer"] == 0] = "No"
-    max_power = int(np.ceil(np.log2(np.max(all_co_occurrence_count))))
-    bins = [2 ** i for i in range(max_power + 1)]
-    buckets = [0] * len(bins)
-    counts = [0] * len(bins)
-    for i, p in enumerate(all_co_occurrence_count):
-        if p <= 2:
-            buckets[0] += all_yes_count_percentage[i]
-            counts[0] += 1
-        else:
-            buckets[int(np.floor(np.log2(p)))] += all_yes_count_percentage[i]
-            counts[int(np.floor(np.log2(p)))] += 1
-    Y = np.array(buckets) / np.array(counts)
+    bins, counts, Y = log_binned_curve(all_co_occurrence_count, all_yes_count_percentage)
     for i in range(len(bins)):
         print(f"Bin {bins[i-1] if i > 0 else 0} - {bins[i]} | Count {counts[i]} | Yes Percentage {Y[i]}")
 
@@ -205,8 +188,7 @@ def plot_cooccurrence():
     plt.ylabel("Probability of 'Yes' Answer")
     plt.xlabel("Aggregated (animal, property) pair Co-Occurrence Count")
     plt.grid()
-    plt.show()
-    plt.close()
+    show_or_save(output_path)
 
     plt.hist(all_co_occurrence_count[all_yes_count_percentage == 1], color="blue", alpha=0.4, bins=256, label="LM answers Yes")
     plt.hist(all_co_occurrence_count[all_yes_count_percentage == 0], color="red", alpha=1, bins=256, label="LM answers No")
@@ -216,44 +198,27 @@ def plot_cooccurrence():
     plt.xlabel("(animal, property) pair Co-Occurrence Count")
     plt.legend()
     plt.grid()
-    plt.show()
+    show_or_save("{}_hist{}".format(*os.path.splitext(output_path)) if output_path else "")
 
-def count_property_appears_in_chunks(text_chunks, property):
-    count = 0
-    for text in text_chunks:
-        count += int(find_word_in_text(property, text)) >= 0
-    return count
 
-
-
-def co_occurrence_helper(df_paths, sentences_by_animal, property):
-    df = pd.read_csv(df_paths[0])
-    df2 = pd.read_csv(df_paths[1])
+def co_occurrence_helper(pair, co_occurrence, property, checkpoint=None):
+    df, df2 = load_result_pair(pair, checkpoint)
     animals = np.hstack([df.animal.values, df2.animal.values])
     accuracy = np.hstack([df["accuracy"].values, df2["accuracy"].values])
     yes_count = np.hstack([df["yes_count"].values, df2["yes_count"].values])
     no_count = np.hstack([df["no_count"].values, df2["no_count"].values])
-    co_occurrence_count = np.array([count_property_appears_in_chunks(sentences_by_animal[animal],
-                                    property) if animal in sentences_by_animal and len(sentences_by_animal[animal]) \
-                                    else 0 for animal in animals])
+    matrix, entities, properties = co_occurrence
+    entity_index = {entity: i for i, entity in enumerate(entities)}
+    property_column = matrix[:, list(properties).index(property)].toarray().ravel()
+    co_occurrence_count = np.array([property_column[entity_index[animal]] if animal in entity_index else 0
+                                    for animal in animals])
     mask = np.bitwise_or(accuracy == 1, accuracy == 0)
     p_yes = np.array(yes_count / (yes_count + no_count))
     return co_occurrence_count[mask], p_yes[mask], animals[mask]
 
 
-def plot_occurrence_by_animal(exact=True):
-    df_pairs = [
-        ("../csv/results/animals_cant_fly_questions_result_by_animal.csv", "../csv/results/animals_can_fly_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_a_beak_questions_result_by_animal.csv", "../csv/results/animals_have_a_beak_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_feathers_questions_result_by_animal.csv", "../csv/results/animals_have_feathers_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_fins_questions_result_by_animal.csv", "../csv/results/animals_have_fins_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_fur_questions_result_by_animal.csv", "../csv/results/animals_have_fur_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_hair_questions_result_by_animal.csv", "../csv/results/animals_have_hair_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_horns_questions_result_by_animal.csv", "../csv/results/animals_have_horns_questions_result_by_animal.csv"),
-        # ("../csv/results/animals_dont_have_scales_questions_result_by_animal.csv", "../csv/results/animals_have_scales_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_have_wings_questions_result_by_animal.csv", "../csv/results/animals_have_wings_questions_result_by_animal.csv"),
-        ("../csv/results/animals_dont_live_underwater_questions_result_by_animal.csv", "../csv/results/animals_live_underwater_questions_result_by_animal.csv"),
-    ]
+def plot_occurrence_by_animal(exact=True, unigram_table_dir="wiki_unigram_table", output_path="", num_resamples=10000,
+                              checkpoint=None):
     title = [
         "Can animal fly?",
         "Does a animal have a beak?",
@@ -280,13 +245,11 @@ def plot_occurrence_by_animal(exact=True):
         "underwater",
     ]
 
-    with open("wiki_unigram_dont_delete.pkl", "rb") as f:
-        wiki_unigram = pickle.load(f)
+    wiki_unigram = UnigramTable(unigram_table_dir)
 
     accuracy_by_animal = dict()
-    for idx, df_pair in enumerate(df_pairs):
-        animal_group_A = pd.read_csv(df_pair[0])
-        animal_group_B = pd.read_csv(df_pair[1])
+    for idx, pair in enumerate(RESULT_PAIRS):
+        animal_group_A, animal_group_B = load_result_pair(pair, checkpoint)
         combine_df = pd.concat([animal_group_A, animal_group_B], axis=0)
         for row in combine_df.iterrows():
             row = row[1]
@@ -309,11 +272,13 @@ def plot_occurrence_by_animal(exact=True):
 
     x_ticks = np.arange(0, 160000+1, 160000 // 4)
     x_ticks_labels = [f"{tick // 1000}K" for tick in x_ticks]
-    A = np.hstack([np.ones((len(X), 1)), X.reshape((-1, 1))])
-    b = Y.reshape((-1, 1))
-    res = np.linalg.lstsq(a=A, b=b, rcond=-1)
-    a, b = res[0][0], res[0][1]
+    regression = resample_regression(X, Y, num_resamples=num_resamples)
+    print_regression("accuracy ~ animal count", regression)
+    a, b = regression["intercept"], regression["slope"]
     plt.plot(X, X*b + a, "--", color="red", label="linear regression")
+    x_grid = np.sort(X)
+    plt.fill_between(x_grid, *confidence_band(x_grid, regression["intercepts"], regression["slopes"]), color="red",
+                     alpha=0.1, label="95% bootstrap CI")
     plt.scatter(X, Y, c=color, alpha=0.8)
     plt.colorbar()
     plt.legend()
@@ -321,8 +286,9 @@ def plot_occurrence_by_animal(exact=True):
     plt.xlabel("Animal Occurrence Count in Wikipedia")
     plt.ylabel("Accuracy")
     plt.grid(True)
-    plt.show()
+    show_or_save(output_path)
 
-plot_occurrence_by_animal()
-plot_occurrence_by_property(exact=True)
-plot_cooccurrence()
\ No newline at end of file
+if __name__ == "__main__":
+    plot_occurrence_by_animal()
+    plot_occurrence_by_property(exact=True)
+    plot_cooccurrence()
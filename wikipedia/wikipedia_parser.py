@@ -1,128 +1,138 @@
-import re
-import xml.etree.ElementTree as ET
 from collections import Counter
 import os
-import threading
-import numpy as np
+import json
+import multiprocessing
 import pickle
-import time
 import pandas as pd
+from entity_matcher import BOUNDARIES, find_first
+from wiki_reader import iter_docs, tokenize, shard_progress, shard_size
+from unigram_table import write_unigram_table
+from shard_manifest import ShardManifest, lexicon_version
+from sorted_runs import write_sorted_runs, combine_sorted_runs, partition_path
+from chunk_store import collect_chunks_in_shard, corpus_paths_file
+from mapreduce import MapReduceJob, discover_shards, run_job, load_job_output
+from ngram_counts import ngram_key, count_ngrams_in_shards, merge_ngram_counts, save_ngram_counts
+
+# Sentence chunks are split by word hash so the combine step can merge partitions in parallel.
+NUM_PARTITIONS = 8
+# Version 2 matches the compiled lexicon's plural, possessive and separator variants.
+# Version 3 writes CHUNK_DTYPE records into a per-shard corpus file instead of copied text windows.
+SENTENCES_PROCESSING_VERSION = 3
+# Version 2 keeps the map-reduce spills of every shard instead of one pickled Counter per shard.
+UNIGRAM_PROCESSING_VERSION = 2
+PROPERTY_WORDS = {"fur", "hair", "water", "underwater", "feather", "wing", "fly", "horn", "scale", "fin", "beak"}
+
 
 def find_word_in_text(word, text):
-    indices = set()
-    indices.add(text.find(f" {word} "))
-    indices.add(text.find(f" {word}."))
-    indices.add(text.find(f" {word}s "))
-    indices.add(text.find(f" {word}:"))
-    indices.add(text.find(f'"{word}"'))
-    indices.add(text.find(f' {word}?'))
-    indices.add(text.find(f' {word}-'))
-    indices.add(text.find(f' {word},'))
-    indices.add(text.find(f' {word};'))
-    indices.remove(-1)
-    if len(indices) == 0:
-        return -1
-    else:
-        return min(indices)
-
-
-def compute_unigram():
-    jobs = []
-    for path in os.walk("."):
-        dir, files = path[0], path[-1]
-        if 'wiki_00' in files:
-            jobs += [os.path.join(dir, file) for file in files]
-
-    threads = []
-    jobs_batch = []
-    num_of_threads = 20
-    batch_size = int(max(np.ceil(len(jobs) / num_of_threads), 1))
-    for i in range(0, len(jobs), batch_size):
-        jobs_batch.append(jobs[i: min(i + batch_size, len(jobs))])
-
-    results = [None] * len(jobs)
-
-    def process_job(xml_paths, idx):
-        print(f"Thread {idx} Start total jobs {len(xml_paths)}")
-        for page_num, xml_path in enumerate(xml_paths):
-            with open(xml_path, "r") as f:
-                data_as_str = f.read()
-                time.sleep(1)
-
-            data_as_str = "<top>" + data_as_str + "</top>"
-            root = ET.fromstring(data_as_str)
-            counter = Counter()
-
-            for i, paper in enumerate(root):
-                words = [word.lower() for word in re.sub('[\'\!\?\"\.\,\;\:\(\)\[\]\n]', ' ', paper.text).split(" ") if word]
-                curr_counter = Counter(words)
-                counter.update(curr_counter)
-
-            if (page_num % 25) == 0:
-                print(f"Thread_{idx} processed {page_num} pages.\n")
-
-            if results[idx] is not None:
-                results[idx].update(counter)
-                time.sleep(1)
-            else:
-                results[idx] = counter
-
-    print(f"Batch size: {batch_size}")
-    print(f"total_docs: {batch_size * num_of_threads}")
-    print(f"job queue len={len(jobs_batch)}")
-    time.sleep(5)
-
-    for idx, job in enumerate(jobs_batch):
-        print(idx)
-        thread = threading.Thread(target=process_job, args=(job, idx))
-        threads.append(thread)
-        thread.start()
-
-    for thread in threads:
-        thread.join()
-
-    print("Combine results")
-    final_counter = Counter()
-    for counter in results:
-        final_counter.update(counter)
+    # The original probes, " {word} ", " {word}s " etc., without plural or possessive variants.
+    return find_first(word, text, forms=(), boundaries=BOUNDARIES)
+
+
+def find_wiki_shards(root="."):
+    return discover_shards(root)
+
+
+class UnigramJob(MapReduceJob):
+    """Number of occurrences of every token."""
+
+    def map(self, doc_id, title, text):
+        return Counter(tokenize(text)).items()
+
+    def reduce(self, key, values):
+        return sum(values)
+
+
+def compute_unigram(num_of_workers=None, output_path="wiki_unigram.pkl", table_dir="wiki_unigram_table",
+                    parts_dir="wiki_unigram_parts", manifest_path="wiki_manifest.json"):
+    manifest = ShardManifest(manifest_path, task="unigram", processing_version=UNIGRAM_PROCESSING_VERSION)
+    reduced_path = os.path.join(parts_dir, "unigram.pkl")
+    run_job(UnigramJob(), find_wiki_shards(), reduced_path, num_of_workers=num_of_workers, spill_dir=parts_dir,
+            manifest=manifest)
+    final_counter = Counter(load_job_output(reduced_path, UnigramJob.num_partitions))
 
     print("Done")
-    with open("wiki_unigram.pkl", "wb") as f:
+    with open(output_path, "wb") as f:
         pickle.dump(final_counter, f)
+    write_unigram_table(final_counter, table_dir)
+    return final_counter
+
+
+def collect_ngram_targets():
+    """Lexicon entries, multiword ones included, from the question csvs, all_animals.pkl and the animal-group jsons."""
+    phrases = collect_all_entities().union(PROPERTY_WORDS)
+    if os.path.isfile("../pickle/all_animals.pkl"):
+        with open("../pickle/all_animals.pkl", "rb") as f:
+            phrases.update(pickle.load(f))
+    for file in os.listdir("../json") if os.path.isdir("../json") else []:
+        if file.endswith("_animal_groups.json"):
+            with open(os.path.join("../json", file), "r") as f:
+                for group in json.load(f).values():
+                    phrases.update(group.get("entities", []))
+    return phrases
 
 
-def collect_sentences_with_words(xml_paths, thread_idx, words, sent_length=512):
-    sentences = { word: [] for word in words }
-    print(f"Thread_{thread_idx} Start")
-    for xml_idx, xml_path in enumerate(xml_paths):
-        try:
-            with open(xml_path, "r") as f:
-                data_as_str = f.read()
-            data_as_str = "<top>" + data_as_str + "</top>"
+def _count_ngrams_job(args):
+    xml_paths, max_n, targets, width, depth = args
+    return xml_paths, count_ngrams_in_shards(xml_paths, max_n=max_n, targets=targets, width=width, depth=depth)
 
-            root = ET.fromstring(data_as_str)
-        except Exception as e:
-            print("error in ", xml_path)
-            continue
 
-        for i, paper in enumerate(root):
-            orig_text = paper.text.lower()
-            for word in words:
-                text = orig_text
-                idx = find_word_in_text(word, text)
-                while idx != -1:
-                    chunk = text[max(0, idx - sent_length): min(len(text), idx + sent_length)].lower()
-                    text = text[idx + len(word):]
-                    idx = find_word_in_text(word, text)
-                    sentences[word].append(chunk)
+def compute_ngrams(num_of_workers=None, max_n=4, targets=None, width=2 ** 22, depth=4, output_dir="wiki_ngrams"):
+    """Counts target n-grams exactly and all n-grams up to max_n approximately, with one count-min sketch per job."""
+    jobs = find_wiki_shards()
+    targets = {ngram_key(target) for target in (targets if targets is not None else collect_ngram_targets())}
+    targets = sorted(target for target in targets if target and len(target.split(" ")) <= max_n)
+    num_of_workers = num_of_workers or os.cpu_count()
+    # A few shard groups per worker keep the number of sketches in flight, and so memory, bounded.
+    num_of_groups = min(len(jobs), num_of_workers * 4)
+    groups = [jobs[i::num_of_groups] for i in range(num_of_groups)]
+    print(f"total shards: {len(jobs)} groups: {len(groups)} targets: {len(targets)} workers: {num_of_workers}")
 
-        if xml_idx % 10 == 0:
-            print(f"Thread {thread_idx} processed {xml_idx} papers")
+    merged = None
+    progress = shard_progress(jobs, every=1)
+    with multiprocessing.Pool(processes=num_of_workers) as pool:
+        for group, counts in pool.imap_unordered(_count_ngrams_job,
+                                                 [(group, max_n, targets, width, depth) for group in groups]):
+            merged = counts if merged is None else merge_ngram_counts(merged, counts)
+            progress.update(sum(map(shard_size, group)), len(group))
 
-    with open(f"thread_{thread_idx}_chunks.pkl", "wb") as f:
-        pickle.dump(sentences, f)
+    if merged is None:
+        print("No shards found")
+        return dict()
+    sketch, target_counts, num_of_ngrams = merged
+    save_ngram_counts(output_dir, sketch, target_counts, num_of_ngrams, max_n)
+    print(f"Done, {num_of_ngrams} n-grams")
+    return target_counts
 
-    print(f"Thread_{thread_idx} Done")
+
+class DocumentFrequencyJob(MapReduceJob):
+    """Number of documents every token occurs in."""
+
+    def map(self, doc_id, title, text):
+        for word in set(tokenize(text)):
+            yield word, 1
+
+    def reduce(self, key, values):
+        return sum(values)
+
+
+def compute_document_frequency(num_of_workers=None, output_path="wiki_document_frequency.pkl"):
+    return run_job(DocumentFrequencyJob(), find_wiki_shards(), output_path, num_of_workers=num_of_workers)
+
+
+def is_incremental_merge(manifest, output_path, num_partitions=1):
+    # Only add unmerged partial outputs when the artifact holds exactly the merged ones.
+    return os.path.isfile(partition_path(output_path, 0, num_partitions)) and \
+        len(manifest.outputs(merged=True)) > 0 and not manifest.needs_rebuild()
+
+
+def _collect_sentences_job(args):
+    xml_path, shard_id, words, corpus_path, sent_length = args
+    try:
+        return xml_path, words, corpus_path, collect_chunks_in_shard(xml_path, shard_id, words, corpus_path,
+                                                                     sent_length)
+    except Exception as e:
+        print(f"error in {xml_path}: {e}")
+        return xml_path, words, corpus_path, None
 
 
 def collect_all_entities():
@@ -141,57 +151,71 @@ def collect_all_entities():
     return set(entities)
 
 
-def run_collect_sentences_with_words():
-    jobs = []
-    for path in os.walk("."):
-        dir, files = path[0], path[-1]
-        if 'wiki_00' in files:
-            jobs += [os.path.join(dir, file) for file in files]
-
-    threads = []
-    jobs_batch = []
-    num_of_threads = 20
-    batch_size = int(max(np.ceil(len(jobs) / num_of_threads), 1))
-    for i in range(0, len(jobs), batch_size):
-        jobs_batch.append(jobs[i: min(i + batch_size, len(jobs))])
-
-    print(f"Batch size: {batch_size}")
-    print(f"total_docs: {batch_size * num_of_threads}")
-    print(f"job queue len={len(jobs_batch)}")
-    time.sleep(5)
-    words = collect_all_entities()
-    words = words.union({"fur", "hair", "water", "underwater", "feather", "wing", "fly", "horn", "scale", "fin", "beak"})
+def run_collect_sentences_with_words(num_of_workers=None, sent_length=512, parts_dir="wiki_chunks",
+                                     manifest_path="wiki_manifest.json", words=None,
+                                     output_path="wiki_word_to_sentences.pkl", combine=True):
+    jobs = find_wiki_shards()
+    words = set(words) if words is not None else collect_all_entities().union(PROPERTY_WORDS)
     print(f"words {words}")
     print("len(words)", len(words))
 
-    for thread_idx, job in enumerate(jobs_batch):
-        thread = threading.Thread(target=collect_sentences_with_words, args=(job, thread_idx, words))
-        threads.append(thread)
-        thread.start()
-
-    for thread in threads:
-        thread.join()
-
+    # Finished shards only get the words added to the lexicon since they were processed.
+    manifest = ShardManifest(manifest_path, task="sentences", processing_version=SENTENCES_PROCESSING_VERSION)
+    manifest.drop_stale(jobs)
+    pending = []
+    for xml_path in jobs:
+        pending_words = manifest.pending_words(xml_path, words)
+        if pending_words:
+            corpus_path = os.path.join(parts_dir, f"{manifest.output_prefix(xml_path)}_corpus.txt")
+            pending.append((xml_path, manifest.shard_id(xml_path), sorted(pending_words), corpus_path, sent_length))
+    num_of_workers = num_of_workers or os.cpu_count()
+    print(f"total shards: {len(jobs)} pending: {len(pending)} workers: {num_of_workers}")
+    os.makedirs(parts_dir, exist_ok=True)
+
+    progress = shard_progress([job[0] for job in pending], every=10)
+    with multiprocessing.Pool(processes=num_of_workers) as pool:
+        for shard_num, (xml_path, shard_words, corpus_path, chunks) in \
+                enumerate(pool.imap_unordered(_collect_sentences_job, pending)):
+            progress.update(shard_size(xml_path))
+            if chunks is None:
+                continue
+            part_path = os.path.join(parts_dir,
+                                     f"{manifest.output_prefix(xml_path)}_{lexicon_version(shard_words)}_chunks.pkl")
+            write_sorted_runs(part_path, chunks, num_partitions=NUM_PARTITIONS)
+            manifest.mark_done(xml_path, part_path, words=shard_words, num_partitions=NUM_PARTITIONS,
+                               corpus_path=corpus_path)
+            if shard_num % 10 == 0:
+                manifest.save()
+    manifest.save()
+
+    if combine:
+        combine_wiki_threads(output_path=output_path, manifest=manifest, num_of_workers=num_of_workers)
     print("All Done")
 
-def combine_wiki_threads():
-    files = [x for x in os.listdir(".") if x.endswith("chunks.pkl")]
-    print(files)
-    combine = dict()
-    for file in files:
-        with open(file, "rb") as f:
-            data = pickle.load(f)
 
-        for k, v in data.items():
-            if k in combine:
-                combine[k] += v
-            else:
-                combine[k] = v
+def combine_wiki_threads(output_path="wiki_word_to_sentences.pkl", manifest=None, manifest_path="wiki_manifest.json",
+                         num_of_workers=None):
+    manifest = manifest or ShardManifest(manifest_path, task="sentences",
+                                         processing_version=SENTENCES_PROCESSING_VERSION)
+    # Runs are merged per hash partition, so the existing artifact is just one more sorted input.
+    if is_incremental_merge(manifest, output_path, NUM_PARTITIONS):
+        files = manifest.outputs(merged=False) + [output_path]
+    else:
+        files = manifest.outputs()
+    print(f"Merge {len(files)} runs into {NUM_PARTITIONS} partitions")
+    num_of_words = combine_sorted_runs(files, output_path, num_partitions=NUM_PARTITIONS,
+                                       num_of_workers=num_of_workers)
+    print(f"Combined {num_of_words} words")
+    # Chunk records point into the per-shard corpus files, see chunk_store.ChunkStore.
+    with open(corpus_paths_file(output_path), "w") as f:
+        json.dump(manifest.corpus_paths(), f)
+    manifest.mark_merged()
+    manifest.save()
 
-    with open("wiki_word_to_sentences.pkl", "wb") as f:
-        pickle.dump(combine, f)
 
 if __name__ == "__main__":
     # run_collect_sentences_with_words()
     # compute_unigram()
+    # compute_ngrams()
+    # compute_document_frequency()
     combine_wiki_threads()
\ No newline at end of file